@@ -0,0 +1,143 @@
+"""Offline end-to-end load benchmark for the API.
+
+Drives main.app in-process with N concurrent simulated users, each of whom
+stores their info, answers 5 questions and asks for their story. Groq is
+replaced by bench_fake_llm (served over an in-process HTTP transport) and
+Neo4j by bench_graph's in-memory stand-in, or by the database from .env
+with --neo4j (e.g. a local test container). Nothing leaves the machine.
+
+Reports p50/p95/p99 latency per endpoint, requests/s, and a per-stage
+breakdown (LLM calls by kind, graph statements by kind). Use --max-p95-ms
+to turn it into a release gate: it exits non-zero when any endpoint's p95
+is over the limit.
+
+    python bench_e2e.py --users 20 --llm-latency-ms 300 --graph-rtt-ms 1
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+import httpx
+from groq import AsyncGroq
+
+QUESTIONS = [
+    "Tell me a little about yourself! How would you describe yourself in a few words?",
+    "Tell me about your Friends and Family..",
+    "What are some things you enjoy doing in your free time?",
+    "How are you feeling today—emotionally and psychologically?",
+    "What’s making you feel this way?",
+]
+
+ANSWERS = [
+    "I am a computer science student who loves solving problems.",
+    "I live with my parents and my little brother Rakshit, who is 10.",
+    "I play chess and the piano to relax after classes.",
+    "Honestly a bit anxious and tired, but hopeful.",
+    "My exams are coming up and I worry I haven't prepared enough.",
+]
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+def summarize(name, samples):
+    ms = [s * 1000 for s in samples]
+    return (f"{name:<28} n={len(ms):<5} p50 {percentile(ms, 50):8.1f} ms  "
+            f"p95 {percentile(ms, 95):8.1f} ms  p99 {percentile(ms, 99):8.1f} ms")
+
+# -------------------- Scenario --------------------
+
+async def simulate_user(client, index, timings, background, batch):
+    async def timed(name, method, url, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        timings.setdefault(name, []).append(time.perf_counter() - started)
+        response.raise_for_status()
+        return response
+
+    info = {"name": f"User{index}", "age": "20", "gender": "Female"}
+    stored = (await timed("POST /store-user/", "POST", "/store-user/", json=info)).json()
+    session = {"X-Session-Token": stored["session_token"]}
+
+    if batch:
+        await timed("POST /process-answers/", "POST", "/process-answers/", headers=session,
+                    json={"answers": ANSWERS, "background": background, "final": True})
+    else:
+        for i, answer in enumerate(ANSWERS):
+            await timed("POST /process-answer/", "POST", "/process-answer/", headers=session,
+                        json={"text": answer, "background": background, "final": i == len(ANSWERS) - 1})
+
+    await timed("GET /generate-story/", "GET", "/generate-story/", headers=session)
+
+async def run(args):
+    import bench_fake_llm
+    from bench_graph import InMemoryGraph, StandInAsyncDriver
+
+    # Quiet the per-request logging so terminal writes don't skew the numbers
+    if not args.verbose:
+        os.environ["LOG_LEVEL"] = "WARNING"
+
+    import main
+    from resources import resources
+
+    bench_fake_llm.settings.latency = args.llm_latency_ms / 1000
+    bench_fake_llm.settings.token_delay = args.llm_token_ms / 1000
+    fake_llm_http = httpx.AsyncClient(transport=httpx.ASGITransport(app=bench_fake_llm.app))
+    resources._async_llm = AsyncGroq(api_key="offline", base_url="http://fake-llm", http_client=fake_llm_http)
+
+    graph = None
+    if not args.neo4j:
+        graph = InMemoryGraph(rtt=args.graph_rtt_ms / 1000)
+        resources._async_driver = StandInAsyncDriver(graph)
+
+    timings = {}
+    api = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://api", timeout=None)
+    async with main.lifespan(main.app):
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate_user(api, i, timings, args.background, args.batch) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+    await api.aclose()
+
+    return timings, elapsed, bench_fake_llm.settings.stats, graph.stats if graph else {}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="fake LLM time to first token")
+    parser.add_argument("--llm-token-ms", type=float, default=2, help="fake LLM delay per streamed token")
+    parser.add_argument("--graph-rtt-ms", type=float, default=1, help="in-memory graph round-trip latency")
+    parser.add_argument("--neo4j", action="store_true", help="use the Neo4j from .env instead of the in-memory graph")
+    parser.add_argument("--background", action="store_true", help="submit answers as background jobs")
+    parser.add_argument("--batch", action="store_true", help="submit all answers in one /process-answers/ request")
+    parser.add_argument("--max-p95-ms", type=float, help="fail if any endpoint's p95 exceeds this")
+    parser.add_argument("--verbose", action="store_true", help="keep the API's info logging")
+    args = parser.parse_args()
+
+    timings, elapsed, llm_stats, graph_stats = asyncio.run(run(args))
+    requests = sum(len(samples) for samples in timings.values())
+
+    print(f"\n📊 {args.users} users × {len(ANSWERS)} questions in {elapsed:.2f}s — {requests / elapsed:.1f} requests/s\n")
+    print("Endpoints")
+    for name, samples in timings.items():
+        print("  " + summarize(name, samples))
+    print("\nStages")
+    for kind, samples in sorted(llm_stats.items()):
+        print("  " + summarize(f"llm:{kind}", samples))
+    for kind, samples in sorted(graph_stats.items()):
+        print("  " + summarize(f"graph:{kind}", samples))
+
+    if args.max_p95_ms is not None:
+        slow = [name for name, samples in timings.items() if percentile(samples, 95) * 1000 > args.max_p95_ms]
+        if slow:
+            print(f"\n❌ p95 over {args.max_p95_ms} ms: {', '.join(slow)}")
+            sys.exit(1)
+        print(f"\n✅ All endpoints under p95 {args.max_p95_ms} ms")
+
+if __name__ == "__main__":
+    main()
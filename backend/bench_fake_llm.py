@@ -0,0 +1,123 @@
+"""Groq/OpenAI-compatible chat completions stand-in for offline benchmarks.
+
+Serves POST /openai/v1/chat/completions (the path the Groq SDK calls) with
+canned outputs picked from the prompt: names for the people prompt, arrow
+triples for the relationship prompt, JSON for the structured prompt and a
+<think>-prefixed story for the story prompt. Latency is configurable, and
+streamed responses pace their tokens.
+
+Used in-process by bench_e2e.py, or on its own for manual testing:
+
+    uvicorn bench_fake_llm:app --port 8900
+    GROQ_BASE_URL=http://127.0.0.1:8900 uvicorn main:app
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# -------------------- Canned Outputs --------------------
+
+FEELINGS = ["Anxious", "Hopeful", "Lonely", "Grateful", "Tired", "Excited"]
+CONCERNS = ["Upcoming exams", "Finding a job", "Family health", "Moving cities"]
+PLACES = ["Vadodara", "Mumbai", "Pune", "Bengaluru"]
+HOBBIES = ["Playing chess", "Piano", "Running", "Painting"]
+
+STORY = ("<think>\nThe user seems anxious; keep the tone warm and end on hope.\n</think>\n\n"
+         "Tanvi sat by the window, feeling a little lost. But as she looked at the sky, she noticed the way "
+         "the sun always set, only to rise again. She thought of her brother's laugh, of the chess games "
+         "that had carried her through harder weeks, and of every exam she had once feared and then passed. "
+         "Tomorrow held new possibilities, and she was ready to meet them.")
+
+def answer_subject(prompt):
+    """The user's name from the 'Name (age, gender): answer' line, or a fallback."""
+    for line in prompt.splitlines():
+        line = line.strip()
+        if " (" in line and "):" in line:
+            return line.split(" (", 1)[0]
+    return "Tanvi"
+
+def pick(options, prompt, salt):
+    digest = hashlib.sha256((salt + prompt).encode("utf-8")).digest()
+    return options[digest[0] % len(options)]
+
+def canned_triples(prompt):
+    user = answer_subject(prompt)
+    return [
+        {"source": user, "relation": "Sibling", "target": "Rakshit"},
+        {"source": user, "relation": "Feeling", "target": pick(FEELINGS, prompt, "f1")},
+        {"source": user, "relation": "State of Mind", "target": pick(FEELINGS, prompt, "f2")},
+        {"source": user, "relation": "Concern", "target": pick(CONCERNS, prompt, "c")},
+        {"source": user, "relation": "Lives in", "target": pick(PLACES, prompt, "p")},
+        {"source": user, "relation": "Hobby", "target": pick(HOBBIES, prompt, "h")},
+        {"source": "Rakshit", "relation": "Hobby", "target": "Piano"},
+        {"source": pick(PLACES, prompt, "p"), "relation": "Located In", "target": "India"},
+    ]
+
+def canned_reply(prompt):
+    """Returns (kind, content) for the prompt."""
+    if "short story" in prompt:
+        return "story", STORY
+    if "JSON schema" in prompt:
+        return "structured", json.dumps({"persons": [answer_subject(prompt), "Rakshit"], "relationships": canned_triples(prompt)})
+    if "Identify and extract all persons" in prompt:
+        return "people", f"{answer_subject(prompt)}\nRakshit"
+    return "relationships", "\n".join(f"{t['source']} → ({t['relation']}) → {t['target']}" for t in canned_triples(prompt))
+
+# -------------------- Server --------------------
+
+class FakeLLMSettings:
+    def __init__(self):
+        self.latency = float(os.getenv("FAKE_LLM_LATENCY_MS", "300")) / 1000       # time to first token
+        self.token_delay = float(os.getenv("FAKE_LLM_TOKEN_MS", "2")) / 1000        # per streamed token
+        self.stats = {}  # kind -> list of seconds spent answering
+
+settings = FakeLLMSettings()
+app = FastAPI()
+
+def record(kind, started):
+    settings.stats.setdefault(kind, []).append(time.perf_counter() - started)
+
+def usage(prompt, content):
+    prompt_tokens, completion_tokens = len(prompt) // 4, len(content) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    started = time.perf_counter()
+    body = await request.json()
+    prompt = "\n".join(m.get("content") or "" for m in body["messages"])
+    kind, content = canned_reply(prompt)
+    model = body.get("model", "fake")
+    created = int(time.time())
+
+    await asyncio.sleep(settings.latency)
+
+    if not body.get("stream"):
+        record(kind, started)
+        return {
+            "id": f"chatcmpl-{created}",
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage(prompt, content),
+        }
+
+    async def events():
+        # Roughly one token per 4 characters
+        for i in range(0, len(content), 4):
+            chunk = {"id": f"chatcmpl-{created}", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": content[i:i + 4]}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(settings.token_delay)
+        final = {"id": f"chatcmpl-{created}", "object": "chat.completion.chunk", "created": created, "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage(prompt, content)}}
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+        record(kind, started)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -0,0 +1,170 @@
+"""In-memory stand-in for the async Neo4j driver, for offline benchmarks.
+
+Understands the statements this backend actually sends (the UNWIND batches
+from pushneo4j and the per-user reads from fetchfromdb) well enough to keep
+a per-user graph in dictionaries. Anything else (schema bootstrap, health
+checks) succeeds and returns no rows. Every statement costs a configurable
+round-trip latency, and the time spent is recorded per query kind.
+"""
+import re
+import time
+import asyncio
+
+RELATIONSHIP_PATTERN = re.compile(r"MERGE \(a:(\w+) .*?MERGE \(b:(\w+) .*?\[r:`((?:[^`]|``)+)`", re.DOTALL)
+
+class InMemoryGraph:
+    def __init__(self, rtt=0.001):
+        self.rtt = rtt
+        self.nodes = {}   # (user_id, label, name) -> True
+        self.keys = {}    # (user_id, label, key) -> name of the node holding it
+        self.edges = {}   # (user_id, source label, source, relation, target) -> target label
+        self.mentions = {}  # same key -> {"mentions": ..., "answers": [...], "first_seen": ..., "last_seen": ...}
+        self.versions = {}  # user_id -> graph version
+        self.moods = {}     # (user_id, kind, name) -> {"count": ..., "first_seen": ..., "last_seen": ..., "key": ...}
+        self.tones = {}     # user_id -> {"name": latest tone, "seen": ..., "kind": "tone" or "emotion"}
+        self.stats = {}   # query kind -> list of seconds
+
+    def execute(self, query, params):
+        """Applies one statement and returns (kind, rows)."""
+        user_id = params.get("user_id")
+        now = int(time.time() * 1000)  # timestamp() is fixed for the whole statement
+        if "UNWIND $rows" in query and "MERGE (p:Person" in query:
+            for row in params["rows"]:
+                self.merge_node(user_id, "Person", row["key"], row["name"])
+            return "write_persons", []
+
+        match = RELATIONSHIP_PATTERN.search(query)
+        if "UNWIND $rows" in query and match:
+            source_label, target_label, relation = match.group(1), match.group(2), match.group(3).replace("``", "`")
+            mood = re.search(r"MERGE \(m:MoodItem \{user_id: \$user_id, kind: '(\w+)'", query)
+            for row in params["rows"]:
+                source = self.merge_node(user_id, source_label, row["source_key"], row["source"])
+                target = self.merge_node(user_id, target_label, row["target_key"], row["target"])
+                key = (user_id, source_label, source, relation, target)
+                self.edges[key] = target_label
+                props = self.mentions.setdefault(key, {"mentions": 0, "answers": []})
+                if row["answer"] not in props["answers"]:
+                    props["mentions"] += 1
+                    props.setdefault("first_seen", now)
+                    props["last_seen"] = now
+                    props["answers"] = (props["answers"] + [row["answer"]])[-50:]
+                    if mood:
+                        item = self.moods.setdefault((user_id, mood.group(1), target), {"count": 0, "first_seen": now})
+                        item.update(count=item["count"] + 1, last_seen=now, key=row["target_key"])
+            return "write_relationships", []
+
+        if "SET g.latest_tone" in query:
+            for row in params["rows"]:
+                name, item = next(((name, item) for (uid, kind, name), item in self.moods.items()
+                                   if uid == user_id and kind == row["kind"] and item.get("key") == row["key"]), (None, None))
+                tone = self.tones.get(user_id, {"seen": 0, "kind": "emotion"})
+                if (item and item["last_seen"] >= tone["seen"]
+                        and (row["kind"] == "tone" or tone["kind"] == "emotion")):
+                    self.tones[user_id] = {"name": name, "seen": item["last_seen"], "kind": row["kind"]}
+            return "write_tone", []
+        if "MATCH (m:MoodItem" in query:
+            items = [{"kind": kind, "name": name, **item} for (uid, kind, name), item in self.moods.items() if uid == user_id]
+            items.sort(key=lambda item: (item["last_seen"], item["count"]), reverse=True)
+            return "read_mood", [{"latest_tone": self.tones.get(user_id, {}).get("name"), "items": items}]
+        if "MERGE (g:UserGraph" in query:
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+            return "write_version", []
+        if "MATCH (g:UserGraph" in query:
+            return "read_version", [{"version": self.versions[user_id]}] if user_id in self.versions else []
+        if "RETURN p.name AS name, true AS person" in query:
+            rows = [{"name": name, "person": label == "Person"} for (uid, label, name) in self.nodes if uid == user_id]
+            return "read_names", rows
+
+        if "p.user_id > $after" in query:
+            users = sorted({uid for (uid, label, name) in self.nodes if label == "Person" and uid > params["after"]})
+            return "export_users", [{"user_id": uid} for uid in users[:params["limit"]]]
+        if "labels(a)[0] AS source_label" in query:
+            # elementId stand-in: the edge's insertion position, zero-padded so it sorts as a string
+            rows = [{"cursor": f"{position:012d}", "user_id": uid, "source_label": source_label, "source": source,
+                     "relation": relation, "target_label": target_label, "target": target}
+                    for position, ((uid, source_label, source, relation, target), target_label) in enumerate(self.edges.items())
+                    if uid == user_id]
+            rows = [row for row in rows if row["cursor"] > params["after"]]
+            return "export", rows if params.get("limit") is None else rows[:params["limit"]]
+
+        read = re.search(r"MATCH \((\w):(Person|Entity) \{user_id: \$user_id\}\)-\[r\]->\(t\)", query)
+        if read:
+            label = read.group(2)
+            rows = [{"source": source, "relation": relation, "target": target}
+                    for (uid, source_label, source, relation, target) in self.edges
+                    if uid == user_id and source_label == label]
+            return "read_" + label.lower(), rows
+
+        return "other", []
+
+    def merge_node(self, user_id, label, key, name):
+        """MERGE on (user_id, key), naming the node on creation; returns its name."""
+        name = self.keys.setdefault((user_id, label, key), name)
+        self.nodes[(user_id, label, name)] = True
+        return name
+
+    def record(self, kind, started):
+        self.stats.setdefault(kind, []).append(time.perf_counter() - started)
+
+class StandInResult:
+    def __init__(self, rows, kind=None):
+        self.rows = rows
+        self.kind = kind
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for row in self.rows:
+            yield row
+
+    async def single(self):
+        if self.rows:
+            return self.rows[0]
+        return None if self.kind == "read_version" else {0: 1}
+
+    async def data(self):
+        return self.rows
+
+    async def consume(self):
+        return None
+
+class StandInSession:
+    def __init__(self, graph):
+        self.graph = graph
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def run(self, query, parameters=None, **kwargs):
+        started = time.perf_counter()
+        await asyncio.sleep(self.graph.rtt)
+        kind, rows = self.graph.execute(query, {**(parameters or {}), **kwargs})
+        self.graph.record(kind, started)
+        return StandInResult(rows, kind)
+
+    async def execute_write(self, fn, *args, **kwargs):
+        result = await fn(self, *args, **kwargs)
+        await asyncio.sleep(self.graph.rtt)  # commit
+        return result
+
+    async def execute_read(self, fn, *args, **kwargs):
+        return await fn(self, *args, **kwargs)
+
+class StandInAsyncDriver:
+    """Drop-in for neo4j.AsyncDriver backed by an InMemoryGraph."""
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def session(self, **kwargs):
+        return StandInSession(self.graph)
+
+    async def verify_connectivity(self):
+        return None
+
+    async def close(self):
+        return None
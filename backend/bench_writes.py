@@ -0,0 +1,150 @@
+"""Benchmarks the original per-row write path against the batched UNWIND write path.
+
+The per-row path replays the statements store_in_neo4j sent before writes
+were batched: one auto-commit MERGE per person and per relationship (two for
+a bidirectional one), with only a user_id added to every node so --live runs
+stay in the benchmark's own subgraph.
+
+Runs against the Neo4j instance configured in .env when --live is given,
+otherwise against an in-process stand-in that charges a fixed round-trip
+latency for every statement and commit.
+
+    python bench_writes.py --triples 30 --runs 20 --rtt-ms 2
+    python bench_writes.py --triples 30 --runs 20 --live
+"""
+import argparse
+import statistics
+import time
+
+from pushneo4j import build_write_batches, write_batches, is_bidirectional, is_description_relation
+
+# Keeps benchmark data in its own subgraph when run with --live
+BENCH_USER_ID = "bench-writes"
+
+# -------------------- Synthetic Data --------------------
+
+def synthetic_answer(n_triples, seed=0):
+    """Builds an answer-sized extraction with a realistic mix of relationship kinds."""
+    user = f"BenchUser{seed}"
+    persons = [user] + [f"BenchFriend{seed}_{i}" for i in range(max(1, n_triples // 6))]
+    relations = ["Feeling", "Concern", "Lives in", "Hobby", "State of Mind", "Belief"]
+    relationships = []
+    for i in range(n_triples):
+        if i % 6 == 0:
+            relationships.append({"source": user, "relation": "Friend", "target": persons[1 + (i // 6) % (len(persons) - 1)]})
+        elif i % 6 == 5:
+            relationships.append({"source": f"Place{seed}_{i}", "relation": "Located In", "target": f"City{seed}_{i}"})
+        else:
+            relationships.append({"source": user, "relation": relations[i % len(relations)], "target": f"Value{seed}_{i}"})
+    return persons, relationships
+
+# -------------------- Stand-in Driver --------------------
+
+class StandInResult:
+    def consume(self):
+        return None
+
+class StandInSession:
+    """Session that sleeps one round-trip per statement, and one more per explicit commit."""
+
+    def __init__(self, stats, rtt):
+        self.stats = stats
+        self.rtt = rtt
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, parameters=None, **kwargs):
+        self.stats["round_trips"] += 1
+        time.sleep(self.rtt)
+        return StandInResult()
+
+    def execute_write(self, fn, *args):
+        result = fn(self, *args)
+        self.run("COMMIT")
+        return result
+
+class StandInDriver:
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.stats = {"round_trips": 0}
+
+    def session(self):
+        return StandInSession(self.stats, self.rtt)
+
+# -------------------- Write Paths --------------------
+
+def write_per_row(driver, persons, relationships):
+    """The original write path: one auto-commit statement per person and per relationship."""
+    def merge_pair(session, source_label, relation, target_label, source, target, create=False):
+        query = f"""
+        MERGE (a:{source_label} {{name: $source, user_id: $user_id}})
+        MERGE (b:{target_label} {{name: $target, user_id: $user_id}})
+        {"CREATE" if create else "MERGE"} (a)-[:`{relation}`]->(b)
+        """
+        session.run(query, source=source, target=target, user_id=BENCH_USER_ID).consume()
+
+    with driver.session() as session:
+        for person in persons:
+            session.run("MERGE (p:Person {name: $name, user_id: $user_id})", name=person, user_id=BENCH_USER_ID).consume()
+
+        entity_descriptions = {}
+        for rel in relationships:
+            source, relation, target = rel["source"], rel["relation"], rel["target"]
+            if target not in persons and is_description_relation(relation):
+                entity_descriptions[target] = {"relation": relation, "description": source}
+            elif source in persons and target in persons:
+                merge_pair(session, "Person", relation, "Person", source, target)
+                if is_bidirectional(relation):
+                    merge_pair(session, "Person", relation, "Person", target, source)
+            elif source in persons:
+                merge_pair(session, "Person", relation, "Entity", source, target)
+            else:
+                merge_pair(session, "Entity", relation, "Entity", source, target)
+
+        for entity, details in entity_descriptions.items():
+            merge_pair(session, "Entity", details["relation"], "Entity", details["description"], entity, create=True)
+
+def write_batched(driver, persons, relationships):
+    """The current write path: one UNWIND per group inside a single managed transaction."""
+    with driver.session() as session:
+        session.execute_write(write_batches, build_write_batches(persons, relationships), BENCH_USER_ID)
+
+def bench(name, write, driver, answers):
+    timings = []
+    for persons, relationships in answers:
+        start = time.perf_counter()
+        write(driver, persons, relationships)
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"{name:<10} mean {statistics.mean(timings):8.2f} ms   "
+          f"p50 {statistics.median(timings):8.2f} ms   max {max(timings):8.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--triples", type=int, default=30, help="relationships per answer")
+    parser.add_argument("--runs", type=int, default=20, help="answers written per path")
+    parser.add_argument("--rtt-ms", type=float, default=2.0, help="stand-in round-trip latency")
+    parser.add_argument("--live", action="store_true", help="write to the Neo4j instance from .env")
+    args = parser.parse_args()
+
+    answers = [synthetic_answer(args.triples, seed) for seed in range(args.runs)]
+    print(f"📊 {args.runs} answers × {args.triples} triples, "
+          f"{len(build_write_batches(*answers[0]))} batches per answer\n")
+
+    if args.live:
+        from resources import resources
+        bench("per-row", write_per_row, resources.driver, answers)
+        bench("batched", write_batched, resources.driver, answers)
+        resources.close()
+        return
+
+    for name, write in (("per-row", write_per_row), ("batched", write_batched)):
+        driver = StandInDriver(args.rtt_ms / 1000)
+        bench(name, write, driver, answers)
+        print(f"{'':<10} {driver.stats['round_trips'] / args.runs:.1f} round-trips per answer")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import json
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# -------------------- Extraction Cache --------------------
+# Content-addressed cache for LLM extraction results. Entries live in a bounded
+# in-memory LRU, optionally backed by a SQLite file so they survive restarts.
+
+def normalize_text(text):
+    """Normalizes text so retries and double-submits hash to the same key."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+class ExtractionCache:
+    """LRU cache keyed by a hash of (kind, normalized text, model, prompt version, extras)."""
+
+    def __init__(self, max_entries=1024, path=None):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS extraction_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+            self.db.commit()
+
+    @staticmethod
+    def make_key(kind, text, model, prompt_version, *extra):
+        """Builds the content address for one extraction call."""
+        parts = [kind, normalize_text(text), model, str(prompt_version)] + [json.dumps(e, sort_keys=True) for e in extra]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Returns the cached value, or None on a miss."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            if self.db is not None:
+                row = self.db.execute("SELECT value FROM extraction_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        """Stores a JSON-serializable value under key."""
+        with self.lock:
+            self._remember(key, value)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO extraction_cache (key, value, created) VALUES (?, ?, ?)",
+                                (key, json.dumps(value), time.time()))
+                self.db.commit()
+
+    def _remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        """Hit/miss counters and current size."""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "disk_hits": self.disk_hits, "size": len(self.entries)}
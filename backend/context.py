@@ -0,0 +1,97 @@
+from collections import Counter
+
+# -------------------- Story Context Selection --------------------
+# Picks which stored facts go into the story prompt: duplicates are removed,
+# the rest are ranked by how relevant they are to the user and packed into a
+# fixed token budget so prompt size stays flat as the graph grows.
+
+EMOTION_RELATIONS = {"Feeling", "State of Mind"}
+CONCERN_RELATIONS = {"Concern"}
+TONE_RELATIONS = {"Tone"}
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return max(1, (len(text) + 3) // 4)
+
+def format_fact(fact):
+    return f"{fact['source']} → ({fact['relation']}) → {fact['target']}"
+
+def dedupe_facts(facts):
+    """Drops triples that only differ in case or surrounding whitespace, keeping the first seen."""
+    seen = set()
+    unique = []
+    for fact in facts:
+        key = tuple(str(fact[part]).strip().casefold() for part in ("source", "relation", "target"))
+        if key not in seen:
+            seen.add(key)
+            unique.append(fact)
+    return unique
+
+def find_user_node(persons, user_name=None):
+    """The user's Person node: the given name, else the person carrying most emotions/concerns."""
+    if user_name:
+        return user_name
+    mood_sources = Counter(p["source"] for p in persons if p["relation"] in EMOTION_RELATIONS | CONCERN_RELATIONS)
+    counts = mood_sources or Counter(p["source"] for p in persons)
+    return counts.most_common(1)[0][0] if counts else None
+
+def rank_facts(facts, user_node):
+    """Orders facts: emotions and concerns, then 1-hop, then 2-hop neighbours of the user, then the rest."""
+    user = (user_node or "").casefold()
+    neighbours = set()
+    for fact in facts:
+        source, target = fact["source"].casefold(), str(fact["target"]).casefold()
+        if source == user:
+            neighbours.add(target)
+        elif target == user:
+            neighbours.add(source)
+
+    def rank(fact):
+        source, target = fact["source"].casefold(), str(fact["target"]).casefold()
+        if fact["relation"] in EMOTION_RELATIONS | CONCERN_RELATIONS:
+            return 0
+        if user in (source, target):
+            return 1
+        if source in neighbours or target in neighbours:
+            return 2
+        return 3
+
+    return sorted(facts, key=rank)  # sorted() is stable, so stored order breaks ties
+
+def select_context(persons, entities, token_budget, user_name=None, mood=None):
+    """Packs the most relevant facts into token_budget, reporting the facts that didn't fit.
+
+    With a materialized mood summary (see mood.py), emotions and concerns come
+    from it, most recent first, instead of from the mood triples.
+    """
+    facts = rank_facts(dedupe_facts(persons + entities), find_user_node(persons, user_name))
+
+    context = {"emotions": [], "concerns": [], "details": [], "dropped": [], "tokens": 0}
+    if mood is not None:
+        facts = [fact for fact in facts if fact["relation"] not in EMOTION_RELATIONS | CONCERN_RELATIONS | TONE_RELATIONS]
+        for section, key in (("emotions", "emotions"), ("concerns", "concerns")):
+            for item in mood[key]:
+                cost = estimate_tokens(f"- {item['name']}\n")
+                if context["tokens"] + cost > token_budget:
+                    context["dropped"].append({"source": "mood", "relation": section, "target": item["name"]})
+                    continue
+                context[section].append(str(item["name"]))
+                context["tokens"] += cost
+
+    for fact in facts:
+        if fact["relation"] in EMOTION_RELATIONS:
+            section, line = "emotions", str(fact["target"])
+        elif fact["relation"] in CONCERN_RELATIONS:
+            section, line = "concerns", str(fact["target"])
+        else:
+            section, line = "details", format_fact(fact)
+
+        cost = estimate_tokens(f"- {line}\n")
+        if context["tokens"] + cost > token_budget:
+            context["dropped"].append(fact)
+            continue
+
+        context[section].append(line)
+        context["tokens"] += cost
+
+    return context
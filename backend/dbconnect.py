@@ -1,29 +1,108 @@
-import os
-from dotenv import load_dotenv
-from neo4j import GraphDatabase
+import asyncio
+import logging
+from resources import resources  # Lazily-created, shared Neo4j drivers
+from resolve import node_key
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Retrieve credentials from .env
-URI = os.getenv("URI")
-USERNAME = os.getenv("USERNAME")
-PASSWORD = os.getenv("PASSWORD")
-
-
-driver = GraphDatabase.driver(URI, auth=(USERNAME, PASSWORD))
+logger = logging.getLogger(__name__)
 
 # def run_query(query, parameters=None):
 #     """Executes a Cypher query in Neo4j"""
-#     with driver.session() as session:
+#     with resources.driver.session() as session:
 #         session.run(query, parameters or {})
 
-def test_connection():
+async def test_connection():
+    """Checks that Neo4j is reachable; used by the /healthz endpoint instead of at import time."""
     try:
-        with driver.session() as session:
-            result = session.run("RETURN 1")
-            print("Connection successful: ", result.single()[0])
+        async with resources.async_driver.session() as session:
+            result = await session.run("RETURN 1")
+            record = await result.single()
+            logger.debug("Connection successful: %s", record[0])
+            return True
     except Exception as e:
-        print(f"Error connecting to Neo4j: {e}")
+        logger.error("Error connecting to Neo4j: %s", e)
+        return False
+
+# Every node is scoped to a user, so (user_id, name) is the natural key. The
+# uniqueness constraints back MERGE with an index, and the user_id indexes let
+# per-user reads seek straight to one user's subgraph. Writes merge nodes on
+# (user_id, key), the normalized name (see resolve.node_key), so two workers
+# spelling a name differently still write to one node.
+SCHEMA_QUERIES = [
+    "CREATE CONSTRAINT person_user_name IF NOT EXISTS FOR (p:Person) REQUIRE (p.user_id, p.name) IS UNIQUE",
+    "CREATE CONSTRAINT entity_user_name IF NOT EXISTS FOR (e:Entity) REQUIRE (e.user_id, e.name) IS UNIQUE",
+    "CREATE CONSTRAINT person_user_key IF NOT EXISTS FOR (p:Person) REQUIRE (p.user_id, p.key) IS UNIQUE",
+    "CREATE CONSTRAINT entity_user_key IF NOT EXISTS FOR (e:Entity) REQUIRE (e.user_id, e.key) IS UNIQUE",
+    "CREATE INDEX person_user IF NOT EXISTS FOR (p:Person) ON (p.user_id)",
+    "CREATE INDEX entity_user IF NOT EXISTS FOR (e:Entity) ON (e.user_id)",
+    "CREATE CONSTRAINT user_graph_user IF NOT EXISTS FOR (g:UserGraph) REQUIRE g.user_id IS UNIQUE",
+    "CREATE CONSTRAINT mood_item_user_kind_name IF NOT EXISTS FOR (m:MoodItem) REQUIRE (m.user_id, m.kind, m.name) IS UNIQUE",
+    "CREATE INDEX mood_item_user IF NOT EXISTS FOR (m:MoodItem) ON (m.user_id)",
+]
+
+# -------------------- Key Backfill --------------------
+# Nodes written before keys existed get theirs here. A node whose key another
+# node of the user already holds is a duplicate the old writes left behind: it
+# keeps no key and is marked duplicate_of instead, for a manual merge.
+
+KEY_BACKFILL_BATCH_SIZE = 1000
+
+KEYLESS_QUERY = """
+MATCH (n:{label}) WHERE n.key IS NULL AND n.duplicate_of IS NULL
+RETURN elementId(n) AS id, n.user_id AS user_id, n.name AS name
+LIMIT $limit
+"""
+
+SET_KEYS_QUERY = """
+UNWIND $rows AS row
+MATCH (n:{label}) WHERE elementId(n) = row.id
+OPTIONAL MATCH (other:{label} {{user_id: n.user_id, key: row.key}})
+WITH n, row, row.duplicate OR count(other) > 0 AS taken
+SET n.key = CASE WHEN taken THEN null ELSE row.key END,
+    n.duplicate_of = CASE WHEN taken THEN row.key END
+"""
+
+async def backfill_keys(label):
+    """Sets the key of every keyless node with label; returns (keyed, duplicates)."""
+    keyed = duplicates = 0
+    async with resources.async_driver.session() as session:
+        while True:
+            result = await session.run(KEYLESS_QUERY.format(label=label), limit=KEY_BACKFILL_BATCH_SIZE)
+            records = [record async for record in result]
+            if not records:
+                return keyed, duplicates
+            seen = set()
+            rows = []
+            for record in records:
+                key = node_key(record["name"])
+                # Only the first of a batch's namesakes can take the key
+                rows.append({"id": record["id"], "key": key, "duplicate": (record["user_id"], key) in seen})
+                seen.add((record["user_id"], key))
+            result = await session.run(SET_KEYS_QUERY.format(label=label), rows=rows)
+            await result.consume()
+            keyed += len(rows)
+            duplicates += sum(row["duplicate"] for row in rows)
+
+async def bootstrap_schema():
+    """Creates the constraints and indexes the per-user queries rely on, and backfills node keys (idempotent)."""
+    try:
+        async with resources.async_driver.session() as session:
+            for query in SCHEMA_QUERIES:
+                result = await session.run(query)
+                await result.consume()
+        for label in ("Person", "Entity"):
+            keyed, duplicates = await backfill_keys(label)
+            if keyed:
+                logger.info("🔑 Keyed %d %s nodes (%d or more duplicates marked duplicate_of)", keyed, label, duplicates)
+        logger.info("✅ Neo4j schema ready")
+    except Exception as e:
+        logger.error("Error bootstrapping Neo4j schema: %s", e)
+
+async def main():
+    await bootstrap_schema()
+    await resources.aclose()
 
-test_connection()
+if __name__ == "__main__":
+    # Run once before deploying, so no write meets a node that has no key yet
+    from logsetup import configure_logging
+    configure_logging()
+    asyncio.run(main())
@@ -0,0 +1,152 @@
+"""Streams stored triples out of Neo4j as NDJSON, for backups and inspection.
+
+Each user's subgraph is read with a single query whose records the driver
+pulls incrementally (EXPORT_FETCH_SIZE per round-trip), so memory stays flat
+however large the graph is. Triples come out in the order of their
+relationship's elementId, which every line carries as its cursor: passing the
+last cursor back as `after` resumes right behind it, and `limit` caps a page.
+A full export walks users in user_id order, a page at a time off the Person
+user_id index; if it stops, the command that resumes it is printed.
+
+    python export.py --user USER_ID > user.ndjson
+    python export.py --user USER_ID --after CURSOR --limit 10000 >> user.ndjson
+    python export.py --out graph.ndjson                                    # every user
+    python export.py --out graph.ndjson --from-user USER_ID --after CURSOR # resume, appending
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+import metrics
+from resources import resources  # Lazily-created, shared Neo4j drivers
+
+# Records the driver pulls per round-trip while a query is being read
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))
+# User ids fetched per page while exporting every user
+EXPORT_USER_PAGE_SIZE = int(os.getenv("EXPORT_USER_PAGE_SIZE", "1000"))
+
+# -------------------- Queries --------------------
+
+# Seeks the user_id index in order, so each page costs the same however many users come before it
+USERS_PAGE_QUERY = """
+MATCH (p:Person) WHERE p.user_id > $after
+RETURN DISTINCT p.user_id AS user_id
+ORDER BY user_id
+LIMIT $limit
+"""
+
+USER_EXPORT_QUERY = """
+CALL {
+    MATCH (a:Person {user_id: $user_id})-[r]->(b) RETURN a, r, b
+    UNION ALL
+    MATCH (a:Entity {user_id: $user_id})-[r]->(b) RETURN a, r, b
+}
+WITH a, r, b, elementId(r) AS cursor
+WHERE cursor > $after
+RETURN cursor, a.user_id AS user_id, labels(a)[0] AS source_label, a.name AS source,
+       type(r) AS relation, labels(b)[0] AS target_label, b.name AS target
+ORDER BY cursor
+"""
+
+# -------------------- Export --------------------
+
+async def export_user_async(user_id, after="", limit=None, fetch_size=EXPORT_FETCH_SIZE):
+    """Yields the triples of one user's subgraph (as dicts) behind the after cursor, at most limit of them."""
+    query = USER_EXPORT_QUERY if limit is None else USER_EXPORT_QUERY + "LIMIT $limit"
+    rows = 0
+    started = time.perf_counter()
+    async with resources.async_driver.session(fetch_size=fetch_size) as session:
+        result = await session.run(query, user_id=user_id, after=after or "", limit=limit)
+        async for record in result:
+            rows += 1
+            yield dict(record)
+    metrics.observe_query("export", rows, started)
+
+async def user_ids_async(start="", page_size=EXPORT_USER_PAGE_SIZE):
+    """Yields every user_id from start (inclusive) on, in order."""
+    page = [start] if start else []
+    after = start
+    while True:
+        for user_id in page:
+            yield user_id
+        async with resources.async_driver.session() as session:
+            result = await session.run(USERS_PAGE_QUERY, after=after, limit=page_size)
+            page = [record["user_id"] async for record in result]
+        if not page:
+            return
+        after = page[-1]
+
+def ndjson(triple):
+    return json.dumps(triple, ensure_ascii=False) + "\n"
+
+async def export_ndjson_async(user_id, after="", limit=None, fetch_size=EXPORT_FETCH_SIZE):
+    """export_user_async, one JSON document per line."""
+    async for triple in export_user_async(user_id, after, limit, fetch_size):
+        yield ndjson(triple)
+
+# -------------------- CLI --------------------
+
+async def single_user(user_id):
+    yield user_id
+
+async def export(out, user_id, from_user, after, limit, fetch_size):
+    count = 0
+    users = 0
+    last = None  # (user_id, cursor) of the last line written
+    started = time.monotonic()
+    try:
+        user_ids = single_user(user_id) if user_id else user_ids_async(from_user or "")
+        async for uid in user_ids:
+            # The cursor only applies to the user the export stopped in
+            first = uid == (user_id or from_user)
+            remaining = None if limit is None else limit - count
+            async for triple in export_user_async(uid, after if first else "", remaining, fetch_size):
+                out.write(ndjson(triple))
+                last = (uid, triple["cursor"])
+                count += 1
+                if count % 10000 == 0:
+                    print(f"📦 {count} triples — {count / (time.monotonic() - started):.0f} triples/s", file=sys.stderr)
+            users += 1
+            if limit is not None and count >= limit:
+                break
+    except BaseException:
+        resume_hint("⚠️ Export stopped", user_id, last or (user_id or from_user, after))
+        raise
+    finally:
+        await resources.aclose()
+    if limit is not None and count >= limit and last:
+        resume_hint("📄 Limit reached", user_id, last)
+    print(f"✅ Exported {count} triples of {users} users", file=sys.stderr)
+
+def resume_hint(reason, user_id, last):
+    uid, cursor = last
+    if not uid:
+        print(f"{reason} before the first triple; start it again", file=sys.stderr)
+        return
+    where = f"--user {user_id}" if user_id else f"--from-user {uid}"
+    print(f"{reason}; continue with {where}" + (f" --after {cursor}" if cursor else ""), file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", help="only export this user_id")
+    parser.add_argument("--from-user", help="start a full export at this user_id (appends to --out)")
+    parser.add_argument("--after", help="resume behind this cursor (in --user, or in --from-user)")
+    parser.add_argument("--limit", type=int, help="export at most this many triples")
+    parser.add_argument("--fetch-size", type=int, default=EXPORT_FETCH_SIZE, help="records fetched per round-trip")
+    parser.add_argument("--out", help="output file (default: stdout)")
+    args = parser.parse_args()
+    if args.user and args.from_user:
+        parser.error("--from-user only applies to a full export")
+
+    run = (args.user, args.from_user, args.after, args.limit, args.fetch_size)
+    if args.out:
+        with open(args.out, "a" if args.from_user or args.after else "w", encoding="utf-8") as out:
+            asyncio.run(export(out, *run))
+    else:
+        asyncio.run(export(sys.stdout, *run))
+
+if __name__ == "__main__":
+    main()
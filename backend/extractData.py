@@ -1,19 +1,66 @@
 import os
 import re
-from groq import Groq
-from dotenv import load_dotenv
+import json
+import asyncio
+import logging
+import textwrap
+from pydantic import BaseModel, ValidationError
+from llm import dispatcher, BACKGROUND  # Rate-limited, retrying access to the shared Groq clients
+from cache import ExtractionCache
+from context import dedupe_facts
+import metrics
+import prompts
 
-# Load environment variables from .env file
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-# Initialize Groq client
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+EXTRACTION_MODEL = "llama-3.3-70b-versatile"
 
+# "two_step" runs extract_people then extract_relationships_and_emotions,
+# "structured" gets persons and relationships back from a single JSON call,
+# "streaming" is two_step with relationships parsed (and stored) while the model is still generating
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "two_step")
 
-def extract_people(text):
-    """Extracts all persons mentioned in the given text using API."""
+# Repeated answers (retries, double-submits, test replays) are served from here instead of Groq.
+# Set EXTRACTION_CACHE_PATH to a SQLite file to keep entries across restarts.
+extraction_cache = ExtractionCache(
+    max_entries=int(os.getenv("EXTRACTION_CACHE_SIZE", "1024")),
+    path=os.getenv("EXTRACTION_CACHE_PATH") or None,
+)
+metrics.register(metrics.Gauge(
+    "extraction_cache_events", "Extraction cache hits, misses, disk hits and entries held in memory.",
+    lambda: {(("event", event),): value for event, value in extraction_cache.stats().items()},
+))
+
+
+def cache_key(kind, text, *extra):
+    """Content address of one extraction call: normalized text, model and prompt version."""
+    return extraction_cache.make_key(kind, text, EXTRACTION_MODEL, prompts.get(kind).version, *extra)
+
+
+def complete(prompt, kind, model=EXTRACTION_MODEL, **kwargs):
+    """Runs a single chat completion for scripts; kind labels the call in /metrics."""
+    return dispatcher.complete_sync(prompt, model, kind, **kwargs)
+
+
+async def complete_async(prompt, kind, model=EXTRACTION_MODEL, **kwargs):
+    """Runs a single chat completion through the shared dispatcher, in the background lane."""
+    return await dispatcher.complete(prompt, model, kind, priority=BACKGROUND, **kwargs)
 
-    prompt = f"""
+
+def build_full_text(user, text):
+    """Prefixes an answer with the user's details; the prompts treat this first line as the user."""
+    return f"{user['name']} ({user['age']}, {user['gender']}): {text}"
+
+
+# -------------------- Prompts --------------------
+# v1 is the original single-message layout, kept for PROMPT_VERSION_OVERRIDES
+# and `python prompts.py --diff`; v2 moves the static instructions into the
+# system message so the answer is the only thing that varies.
+
+SAMPLE_TEXT = build_full_text({"name": "Tanvi", "age": "20", "gender": "Female"},
+                              "I miss my little brother Rakshit a lot, he lives in Pune and sends me videos of him playing the piano.")
+
+prompts.register(prompts.PromptTemplate("people", 1, sample={"text": SAMPLE_TEXT}, user="""
     Identify and extract all persons mentioned in the following text.
     
     **Format the output as:** 
@@ -31,28 +78,95 @@ def extract_people(text):
 
     **Now, analyze the following text:**
     {text}
-    """
+    """))
+
+prompts.register(prompts.PromptTemplate("people", 2, sample={"text": SAMPLE_TEXT}, system="""Identify and extract all persons mentioned in the text the user sends.
 
-    chat_completion = client.chat.completions.create(
-        messages=[{"role": "user", "content": prompt}],
-        model="llama-3.3-70b-versatile",
-        stream=False,
-    )
+**Format the output as:**
+- Just return names, one per line.
+- Do not add any extra text or explanations.
+- Do not return relationships, only names.
+
+**Example Input:**
+"Tanvi and Rakshit went to visit their cousin Siddhant in Mumbai."
+
+**Expected Output:**
+Tanvi
+Rakshit
+Siddhant""", user="""**Now, analyze the following text:**
+{text}"""))
+
+
+def build_people_prompt(text):
+    """Builds the chat messages used to identify persons in the text."""
+    return prompts.render("people", text=text).messages
+
+
+def parse_people(extracted_text):
+    """Parses the one-name-per-line model output into a list of persons."""
+    return [line.strip() for line in extracted_text.strip().split("\n") if line.strip()]
+
+
+def extract_people(text):
+    """Extracts all persons mentioned in the given text using API."""
+    key = cache_key("people", text)
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        return cached
 
     # Extract names from API response
-    extracted_text = chat_completion.choices[0].message.content
-    persons_list = [line.strip() for line in extracted_text.strip().split("\n") if line.strip()]
+    extracted_text = complete(build_people_prompt(text), "people")
+    persons_list = parse_people(extracted_text)
+    if persons_list:
+        extraction_cache.set(key, persons_list)
+    return persons_list
+
 
+async def extract_people_async(text):
+    """Async variant of extract_people that doesn't block the event loop."""
+    key = cache_key("people", text)
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        return cached
+
+    persons_list = parse_people(await complete_async(build_people_prompt(text), "people"))
+    if persons_list:
+        extraction_cache.set(key, persons_list)
     return persons_list
 
 
-def extract_relationships_and_emotions(text,persons_list):
-    """Extracts structured relationships, attributes, emotions, and state of mind from a given sentence."""
-    persons_str = ", ".join(persons_list)
-    prompt = f"""
+# Shared by the two-step and structured relationship prompts
+RELATIONSHIP_GUIDELINES = """KINDLY ADHERE TO ALL THE GUIDELINES GIVEN BELOW.
+DO NOT RETURN RELATIONSHIPS WHERE DETAILS FOR THE SAME ARE NOT GIVEN, ONLY EXTRACT FROM GIVEN DATA.
+DO NOT RETURN THINGS NOT MENTIONED
+IF IT IS NOT MENTION LEAVE IT
+DO NOT RETURN THIS: "TARGET:NOT MENTIONED
+Avoid redundant relationships** (e.g., "Sibling" and "Brother" should not be separate).
+
+**Ensure that:**
+- **Personal details** (name, age, gender, nationality, birth/death details) are extracted.
+- **Locations** (place of birth, residence, workplace, significant locations) are included.
+- **Professional roles, achievements, and contributions** (titles, awards, affiliations, key work) are captured.
+- **Dates and events** (birth date, tenure in roles, key events, death date) are extracted.
+- **Relationships between entities** are clearly defined (e.g., "Worked at", "Mentored", "Founded", "Contributed to").
+- **Emotional state and current feelings** are identified (e.g., "Feeling happy", "Experiencing stress", "Feeling nostalgic").
+- **User can feel multiple emotions at a time, hence multiple feelings can exist but not more than 3 at a time.
+- **Concerns, beliefs, and thoughts** are captured (e.g., "Worried about exams", "Believes in persistence", "Feels hopeful").
+- **Tone of the text** is analyzed (e.g., "Optimistic", "Anxious", "Confident", "Frustrated", "Joyful", "Grateful").
+- **No important contextual information is missed**.
+- **Do not form redundant relationships , for example: - Tanvi → (Sibling) → Little brother, Tanvi → (Relationship) → Sister , Tanvi → (Family) → Has a brother
+- **Also give output in given format only, do not write anything else, Tanvi → (State of Mind) → Sadness (inferred from feeling lonely), don't write the part in brackets.
+- **Person-to-person relationships** are correctly identified (e.g., "Tanvi → (Sibling) → Rakshit" instead of "Rakshit → (Relation) → Brother").
+- **Do Not miss out on any relationship.
+- **Do not send out any relationship where any details are not mentioned."""
+# The same guidelines as the v1 prompts sent them, indented inside the f-string
+LEGACY_GUIDELINES = textwrap.indent(RELATIONSHIP_GUIDELINES, "    ")[4:]
+
+
+prompts.register(prompts.PromptTemplate("relationships", 1, sample={"text": SAMPLE_TEXT, "persons": "Tanvi, Rakshit"}, user="""
     Extract all possible **relationships, attributes, emotions, and state of mind** about the person(s) mentioned in the following text.
     
-    **Identified Persons:** {persons_str}
+    **Identified Persons:** {persons}
 
     **Format the output as:**
     - **Person → (Relation) → Value** (for relationships and attributes)
@@ -60,29 +174,7 @@ def extract_relationships_and_emotions(text,persons_list):
     - **Entity → (Relation) → Entity** (relation between two entities)
     - **Entity → (Feeling) → Emotion** (for emotions and mental state)
 
-    KINDLY ADHERE TO ALL THE GUIDELINES GIVEN BELOW.
-    DO NOT RETURN RELATIONSHIPS WHERE DETAILS FOR THE SAME ARE NOT GIVEN, ONLY EXTRACT FROM GIVEN DATA.
-    DO NOT RETURN THINGS NOT MENTIONED
-    IF IT IS NOT MENTION LEAVE IT
-    DO NOT RETURN THIS: "TARGET:NOT MENTIONED
-    Avoid redundant relationships** (e.g., "Sibling" and "Brother" should not be separate).
-
-    **Ensure that:**
-    - **Personal details** (name, age, gender, nationality, birth/death details) are extracted.
-    - **Locations** (place of birth, residence, workplace, significant locations) are included.
-    - **Professional roles, achievements, and contributions** (titles, awards, affiliations, key work) are captured.
-    - **Dates and events** (birth date, tenure in roles, key events, death date) are extracted.
-    - **Relationships between entities** are clearly defined (e.g., "Worked at", "Mentored", "Founded", "Contributed to").
-    - **Emotional state and current feelings** are identified (e.g., "Feeling happy", "Experiencing stress", "Feeling nostalgic").
-    - **User can feel multiple emotions at a time, hence multiple feelings can exist but not more than 3 at a time.
-    - **Concerns, beliefs, and thoughts** are captured (e.g., "Worried about exams", "Believes in persistence", "Feels hopeful").
-    - **Tone of the text** is analyzed (e.g., "Optimistic", "Anxious", "Confident", "Frustrated", "Joyful", "Grateful").
-    - **No important contextual information is missed**.
-    - **Do not form redundant relationships , for example: - Tanvi → (Sibling) → Little brother, Tanvi → (Relationship) → Sister , Tanvi → (Family) → Has a brother
-    - **Also give output in given format only, do not write anything else, Tanvi → (State of Mind) → Sadness (inferred from feeling lonely), don't write the part in brackets.
-    - **Person-to-person relationships** are correctly identified (e.g., "Tanvi → (Sibling) → Rakshit" instead of "Rakshit → (Relation) → Brother").
-    - **Do Not miss out on any relationship.
-    - **Do not send out any relationship where any details are not mentioned.
+    """ + LEGACY_GUIDELINES + """
 
 
     **Example Input:**
@@ -101,16 +193,67 @@ def extract_relationships_and_emotions(text,persons_list):
     If the user refers to as I, this is the user in reference with.
 
     {text}
-    """
+    """))
+
+prompts.register(prompts.PromptTemplate("relationships", 2, sample={"text": SAMPLE_TEXT, "persons": "Tanvi, Rakshit"}, system="""Extract all possible **relationships, attributes, emotions, and state of mind** about the identified person(s) in the text the user sends.
+
+**Format the output as:**
+- **Person → (Relation) → Value** (for relationships and attributes)
+- **Person → (Relation) → Person** (if two people are related)
+- **Entity → (Relation) → Entity** (relation between two entities)
+- **Entity → (Feeling) → Emotion** (for emotions and mental state)
+
+""" + RELATIONSHIP_GUIDELINES + """
+
+
+**Example Input:**
+"Tanvi is feeling anxious about her upcoming exams, but she is hopeful that her hard work will pay off. She lives in Vadodara and enjoys playing chess to relax."
+
+**Expected Output:**
+Tanvi → (Lives in) → Vadodara
+Tanvi → (Hobby) → Playing Chess
+Tanvi → (Feeling) → Anxious
+Tanvi → (Concern) → Upcoming exams
+Tanvi → (Belief) → Hard work will pay off
+Tanvi → (State of Mind) → Hopeful
+
+The first line of the text is user information:
+If the user refers to as I, this is the user in reference with.""", user="""**Identified Persons:** {persons}
+
+**Now, analyze the following text:**
+{text}"""))
+
+
+def build_relationships_prompt(text, persons_list):
+    """Builds the chat messages used to extract relationships, emotions and state of mind."""
+    return prompts.render("relationships", text=text, persons=", ".join(persons_list)).messages
+
 
-    chat_completion = client.chat.completions.create(
-        messages=[{"role": "user", "content": prompt}],
-        model="llama-3.3-70b-versatile",
-        stream=False,
-    )
+def extract_relationships_and_emotions(text,persons_list):
+    """Extracts structured relationships, attributes, emotions, and state of mind from a given sentence."""
+    key = cache_key("relationships", text, persons_list)
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        return cached
+
+    extracted_text = complete(build_relationships_prompt(text, persons_list), "relationships")
+    relationships = parse_extracted_text(extracted_text)
+    if relationships:
+        extraction_cache.set(key, relationships)
+    return relationships
 
-    extracted_text = chat_completion.choices[0].message.content
-    return parse_extracted_text(extracted_text)
+
+async def extract_relationships_and_emotions_async(text, persons_list):
+    """Async variant of extract_relationships_and_emotions that doesn't block the event loop."""
+    key = cache_key("relationships", text, persons_list)
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        return cached
+
+    relationships = parse_extracted_text(await complete_async(build_relationships_prompt(text, persons_list), "relationships"))
+    if relationships:
+        extraction_cache.set(key, relationships)
+    return relationships
 
 def parse_extracted_text(extracted_text):
     """Parses the extracted text into a Neo4j-compatible format."""
@@ -129,6 +272,224 @@ def parse_extracted_text(extracted_text):
 
     return relationships
 
+# -------------------- Streaming Extraction --------------------
+
+class StreamingTripleParser:
+    """Parses Source → (Relation) → Target lines out of a token stream as soon as each newline arrives."""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, chunk):
+        """Consumes one chunk and returns the relationships on the lines it completed."""
+        self.buffer += chunk
+        complete, newline, self.buffer = self.buffer.rpartition("\n")
+        return parse_extracted_text(complete) if newline else []
+
+    def flush(self):
+        """Parses whatever is left once the stream ends (the last line has no newline)."""
+        rest, self.buffer = self.buffer, ""
+        return parse_extracted_text(rest)
+
+
+async def stream_relationships_async(text, persons_list):
+    """Yields lists of relationships as complete lines stream in from the model."""
+    key = cache_key("relationships", text, persons_list)
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    parser = StreamingTripleParser()
+    relationships = []
+    prompt = build_relationships_prompt(text, persons_list)
+    async for delta in dispatcher.stream(prompt, EXTRACTION_MODEL, "relationships", priority=BACKGROUND):
+        triples = parser.feed(delta)
+        if triples:
+            relationships.extend(triples)
+            yield triples
+
+    triples = parser.flush()
+    if triples:
+        relationships.extend(triples)
+        yield triples
+
+    if relationships:
+        extraction_cache.set(key, relationships)
+
+# -------------------- Structured (single-call) Extraction --------------------
+
+class Relationship(BaseModel):
+    source: str
+    relation: str
+    target: str
+
+class StructuredExtraction(BaseModel):
+    persons: list[str]
+    relationships: list[Relationship]
+
+STRUCTURED_SCHEMA = json.dumps(StructuredExtraction.model_json_schema())
+
+
+prompts.register(prompts.PromptTemplate("structured", 1, sample={"text": SAMPLE_TEXT}, user="""
+    Identify all persons mentioned in the following text, and extract all possible **relationships, attributes, emotions, and state of mind** about them.
+
+    **Format the output as:**
+    - A single JSON object matching this JSON schema: """ + STRUCTURED_SCHEMA + """
+    - "persons" holds the names of the persons, one entry per person.
+    - Each item in "relationships" is one Source → (Relation) → Target fact, where the source and target are persons, entities or values.
+    - Do not add any extra text or explanations outside the JSON object.
+
+    """ + LEGACY_GUIDELINES + """
+
+
+    **Example Input:**
+    "Tanvi is feeling anxious about her upcoming exams. She lives in Vadodara with her brother Rakshit."
+
+    **Expected Output:**
+    {"persons": ["Tanvi", "Rakshit"], "relationships": [{"source": "Tanvi", "relation": "Feeling", "target": "Anxious"}, {"source": "Tanvi", "relation": "Concern", "target": "Upcoming exams"}, {"source": "Tanvi", "relation": "Lives in", "target": "Vadodara"}, {"source": "Tanvi", "relation": "Sibling", "target": "Rakshit"}]}
+
+    **Now, analyze the following text:**
+    The first line of the text is user information:
+    If the user refers to as I, this is the user in reference with.
+
+    {text}
+    """))
+
+prompts.register(prompts.PromptTemplate("structured", 2, sample={"text": SAMPLE_TEXT}, system="""Identify all persons mentioned in the text the user sends, and extract all possible **relationships, attributes, emotions, and state of mind** about them.
+
+**Format the output as:**
+- A single JSON object matching this JSON schema: """ + STRUCTURED_SCHEMA + """
+- "persons" holds the names of the persons, one entry per person.
+- Each item in "relationships" is one Source → (Relation) → Target fact, where the source and target are persons, entities or values.
+- Do not add any extra text or explanations outside the JSON object.
+
+""" + RELATIONSHIP_GUIDELINES + """
+
+
+**Example Input:**
+"Tanvi is feeling anxious about her upcoming exams. She lives in Vadodara with her brother Rakshit."
+
+**Expected Output:**
+{"persons": ["Tanvi", "Rakshit"], "relationships": [{"source": "Tanvi", "relation": "Feeling", "target": "Anxious"}, {"source": "Tanvi", "relation": "Concern", "target": "Upcoming exams"}, {"source": "Tanvi", "relation": "Lives in", "target": "Vadodara"}, {"source": "Tanvi", "relation": "Sibling", "target": "Rakshit"}]}
+
+The first line of the text is user information:
+If the user refers to as I, this is the user in reference with.""", user="""**Now, analyze the following text:**
+{text}"""))
+
+
+def build_structured_prompt(text):
+    """Builds the chat messages asking for persons and relationships together as JSON."""
+    return prompts.render("structured", text=text).messages
+
+
+def parse_structured_output(extracted_text):
+    """Validates the JSON response, falling back to the regex parser when it is malformed."""
+    try:
+        extraction = StructuredExtraction.model_validate_json(extracted_text)
+        persons = [person.strip() for person in extraction.persons if person.strip()]
+        relationships = [
+            {"source": rel.source.strip(), "relation": rel.relation.strip(), "target": rel.target.strip()}
+            for rel in extraction.relationships
+        ]
+        return persons, relationships
+    except ValidationError:
+        logger.warning("⚠️ Structured output was malformed, falling back to the line parser.")
+
+    # Salvage whatever we can: the persons array if present, and any arrow-formatted lines
+    persons = []
+    match = re.search(r'"persons"\s*:\s*\[(.*?)\]', extracted_text, re.DOTALL)
+    if match:
+        persons = [name.strip() for name in re.findall(r'"([^"]+)"', match.group(1)) if name.strip()]
+
+    return persons, parse_extracted_text(extracted_text)
+
+
+def extract_structured(text):
+    """Extracts persons and relationships in a single round-trip."""
+    key = cache_key("structured", text)
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        return tuple(cached)
+
+    extracted_text = complete(build_structured_prompt(text), "structured", response_format={"type": "json_object"})
+    persons, relationships = parse_structured_output(extracted_text)
+    if persons and relationships:
+        extraction_cache.set(key, [persons, relationships])
+    return persons, relationships
+
+
+async def extract_structured_async(text):
+    """Async variant of extract_structured that doesn't block the event loop."""
+    key = cache_key("structured", text)
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        return tuple(cached)
+
+    extracted_text = await complete_async(build_structured_prompt(text), "structured", response_format={"type": "json_object"})
+    persons, relationships = parse_structured_output(extracted_text)
+    if persons and relationships:
+        extraction_cache.set(key, [persons, relationships])
+    return persons, relationships
+
+
+# -------------------- Mode Dispatch --------------------
+
+def extract_answer(text):
+    """Returns (persons, relationships) for the text using the configured EXTRACTION_MODE.
+
+    Callers that can't overlap writes with generation treat "streaming" like "two_step".
+    """
+    if EXTRACTION_MODE == "structured":
+        return extract_structured(text)
+
+    persons = extract_people(text)
+    return persons, extract_relationships_and_emotions(text, persons)
+
+
+async def extract_answer_async(text):
+    """Async variant of extract_answer used by the API server."""
+    if EXTRACTION_MODE == "structured":
+        return await extract_structured_async(text)
+
+    persons = await extract_people_async(text)
+    return persons, await extract_relationships_and_emotions_async(text, persons)
+
+
+def unique_names(names):
+    """Names in first-seen order, ignoring case and surrounding whitespace."""
+    seen = set()
+    unique = []
+    for name in names:
+        key = name.strip().casefold()
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(name.strip())
+    return unique
+
+
+async def extract_answers_async(user, answers):
+    """Extracts a whole questionnaire at once and returns (persons, [(full_text, relationships) per answer]).
+
+    In two_step/streaming mode persons are extracted once from all answers together,
+    then relationships for every answer run concurrently against that shared list.
+    Structured mode runs its single call per answer concurrently. Relationships
+    stay with the answer they came from, so each one is stored (and counted)
+    under the same full text /process-answer/ would use.
+    """
+    full_texts = [build_full_text(user, answer) for answer in answers]
+
+    if EXTRACTION_MODE == "structured":
+        results = await asyncio.gather(*(extract_structured_async(text) for text in full_texts))
+        persons = unique_names(person for answer_persons, _ in results for person in answer_persons)
+        return persons, [(text, dedupe_facts(answer_relationships)) for text, (_, answer_relationships) in zip(full_texts, results)]
+
+    persons = await extract_people_async(build_full_text(user, "\n".join(answers)))
+    if not persons:
+        return [], []
+    results = await asyncio.gather(*(extract_relationships_and_emotions_async(text, persons) for text in full_texts))
+    return persons, [(text, dedupe_facts(answer_relationships)) for text, answer_relationships in zip(full_texts, results)]
+
 if __name__ == "__main__":
     sentence = "  Tanvi Female 20   Tanvi is 20 years old, she is in her prefinal year of computer science engineering. She loves her family, especially her brother who is 10 years younger than her. She will visit him for his birthday on 28 December. His name is Rakshit. Tanvi misses him a lot."
 
@@ -1,30 +1,81 @@
-from dbconnect import driver  # Use established Neo4j connection
-
-def fetch_all_persons():
-    """Fetches all persons and their relationships from the Neo4j database."""
-    query = """
-    MATCH (p:Person)-[r]->(t)
-    RETURN p.name AS source, type(r) AS relation, t.name AS target
-    """  # 🔹 Fetch actual relationship type
-    with driver.session() as session:
-        results = session.run(query)
-        return [{"source": record["source"], "relation": record["relation"], "target": record["target"]} for record in results]
-
-def fetch_all_entities():
-    """Fetches all entities and their relationships from the Neo4j database."""
-    query = """
-    MATCH (e:Entity)-[r]->(t)
-    RETURN e.name AS source, type(r) AS relation, t.name AS target
-    """  # 🔹 Fetch actual relationship type
-    with driver.session() as session:
-        results = session.run(query)
-        return [{"source": record["source"], "relation": record["relation"], "target": record["target"]} for record in results]
-
-def fetch_all_data():
-    """Fetches and prints all stored data from Neo4j."""
-    persons = fetch_all_persons()
-    entities = fetch_all_entities()
+import sys
+import time
+import logging
+import metrics
+from resources import resources  # Lazily-created, shared Neo4j drivers
 
+logger = logging.getLogger(__name__)
+
+# 🔹 Fetch actual relationship type, seeking on the user_id index
+PERSONS_QUERY = """
+MATCH (p:Person {user_id: $user_id})-[r]->(t)
+RETURN p.name AS source, type(r) AS relation, t.name AS target
+"""
+
+ENTITIES_QUERY = """
+MATCH (e:Entity {user_id: $user_id})-[r]->(t)
+RETURN e.name AS source, type(r) AS relation, t.name AS target
+"""
+
+GRAPH_VERSION_QUERY = """
+MATCH (g:UserGraph {user_id: $user_id})
+RETURN g.version AS version
+"""
+
+def to_triple(record):
+    return {"source": record["source"], "relation": record["relation"], "target": record["target"]}
+
+def fetch_triples(query, kind, user_id):
+    """Runs one per-user read and records its latency and row count."""
+    started = time.perf_counter()
+    with resources.driver.session() as session:
+        triples = [to_triple(record) for record in session.run(query, user_id=user_id)]
+    metrics.observe_query(kind, len(triples), started)
+    return triples
+
+async def fetch_triples_async(query, kind, user_id):
+    """Async variant of fetch_triples."""
+    started = time.perf_counter()
+    async with resources.async_driver.session() as session:
+        results = await session.run(query, user_id=user_id)
+        triples = [to_triple(record) async for record in results]
+    metrics.observe_query(kind, len(triples), started)
+    return triples
+
+def fetch_all_persons(user_id):
+    """Fetches all persons and their relationships from the user's subgraph."""
+    return fetch_triples(PERSONS_QUERY, "read_persons", user_id)
+
+def fetch_all_entities(user_id):
+    """Fetches all entities and their relationships from the user's subgraph."""
+    return fetch_triples(ENTITIES_QUERY, "read_entities", user_id)
+
+async def fetch_all_persons_async(user_id):
+    """Async variant of fetch_all_persons."""
+    return await fetch_triples_async(PERSONS_QUERY, "read_persons", user_id)
+
+async def fetch_all_entities_async(user_id):
+    """Async variant of fetch_all_entities."""
+    return await fetch_triples_async(ENTITIES_QUERY, "read_entities", user_id)
+
+def fetch_graph_version(user_id):
+    """The user's graph version, bumped by every write (0 before the first one)."""
+    started = time.perf_counter()
+    with resources.driver.session() as session:
+        record = session.run(GRAPH_VERSION_QUERY, user_id=user_id).single()
+    metrics.observe_query("read_version", 1 if record else 0, started)
+    return record["version"] if record else 0
+
+async def fetch_graph_version_async(user_id):
+    """Async variant of fetch_graph_version."""
+    started = time.perf_counter()
+    async with resources.async_driver.session() as session:
+        result = await session.run(GRAPH_VERSION_QUERY, user_id=user_id)
+        record = await result.single()
+    metrics.observe_query("read_version", 1 if record else 0, started)
+    return record["version"] if record else 0
+
+def print_data(persons, entities):
     print("\n📌 Persons and Their Relationships:")
     for person in persons:
         print(f"{person['source']} → ({person['relation']}) → {person['target']}")  # ✅ Fixed key names
@@ -33,8 +84,23 @@ def fetch_all_data():
     for entity in entities:
         print(f"{entity['source']} → ({entity['relation']}) → {entity['target']}")  # ✅ Fixed key names
 
+def fetch_all_data(user_id):
+    """Fetches all stored data for one user from Neo4j."""
+    persons = fetch_all_persons(user_id)
+    entities = fetch_all_entities(user_id)
+    logger.debug("🔍 Fetched %d person and %d entity relationships for %s", len(persons), len(entities), user_id)
+    return {"Persons": persons, "Entities": entities}
+
+async def fetch_all_data_async(user_id):
+    """Async variant of fetch_all_data used by the API server."""
+    persons = await fetch_all_persons_async(user_id)
+    entities = await fetch_all_entities_async(user_id)
+    logger.debug("🔍 Fetched %d person and %d entity relationships for %s", len(persons), len(entities), user_id)
     return {"Persons": persons, "Entities": entities}
 
 if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python fetchfromdb.py <user_id>")
     print("🔍 Fetching Data from Neo4j...\n")
-    data = fetch_all_data()
+    data = fetch_all_data(sys.argv[1])
+    print_data(data["Persons"], data["Entities"])
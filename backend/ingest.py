@@ -0,0 +1,241 @@
+"""Bulk-ingests archived questionnaire answers into Neo4j.
+
+Reads a JSONL or CSV file of records with `user_id` and `answer` (plus
+optional `name`, `age`, `gender`) as a stream, extracts them with bounded
+concurrency and rate-limit-aware pacing, and writes them in large batched
+transactions. Progress is checkpointed after every batch, so re-running the
+same command after a crash resumes where it stopped.
+
+    python ingest.py answers.jsonl --concurrency 8 --rpm 30 --batch-size 200
+"""
+import os
+import re
+import csv
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+
+import groq
+
+from extractData import extract_answer_async, build_full_text, EXTRACTION_MODE
+from pushneo4j import store_many_in_neo4j_async
+from resources import resources
+from llm import retry_after_seconds
+
+# -------------------- Input --------------------
+
+# Bytes that aren't valid UTF-8 are decoded to lone surrogates (errors="surrogateescape")
+# so one bad record can be reported and skipped instead of aborting the whole read
+UNDECODABLE = re.compile("[\udc80-\udcff]")
+
+def printable(text):
+    """text with undecodable bytes shown as U+FFFD, safe to write to the failures file."""
+    return text.encode("utf-8", "surrogateescape").decode("utf-8", "replace")
+
+def read_records(path):
+    """Yields (index, record, error) from a JSONL or CSV file without loading it into memory.
+
+    error is None for good records; records that can't be decoded or parsed keep
+    their index and come back with the raw text and the reason, so they can be skipped.
+    """
+    with open(path, newline="", encoding="utf-8", errors="surrogateescape") as f:
+        if path.endswith(".csv"):
+            reader = csv.DictReader(f)
+            for index in itertools.count():
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    return
+                except csv.Error as e:
+                    yield index, None, f"Malformed CSV row: {e}"
+                    continue
+                values = [value for value in row.values() if isinstance(value, str)]
+                if any(UNDECODABLE.search(value) for value in values):
+                    yield index, {key: printable(value) if isinstance(value, str) else value for key, value in row.items()}, "Not valid UTF-8"
+                else:
+                    yield index, row, None
+        else:
+            lines = (line for line in f if line.strip())
+            for index, line in enumerate(lines):
+                if UNDECODABLE.search(line):
+                    yield index, printable(line.strip()), "Not valid UTF-8"
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield index, line.strip(), f"Malformed JSON: {e}"
+                    continue
+                if not isinstance(record, dict):
+                    yield index, line.strip(), "Not a JSON object"
+                    continue
+                yield index, record, None
+
+def record_text(record):
+    """The text to extract from, prefixed with the user's details when the archive has them."""
+    if record.get("name"):
+        return build_full_text({"name": record["name"], "age": record.get("age", ""), "gender": record.get("gender", "")}, record["answer"])
+    return record["answer"]
+
+# -------------------- Checkpointing --------------------
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["next_index"]
+
+def save_checkpoint(path, next_index):
+    """Atomically records that every record before next_index is stored."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"next_index": next_index, "saved_at": time.time()}, f)
+    os.replace(tmp, path)
+
+# -------------------- Pacing --------------------
+
+class Pacer:
+    """Spaces out LLM calls to stay under a requests-per-minute budget."""
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self, calls=1):
+        async with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_slot)
+            self.next_slot = start + self.interval * calls
+        await asyncio.sleep(start - now)
+
+    def back_off(self, seconds):
+        """Pushes every future slot back after the API reported a rate limit."""
+        self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+# -------------------- Ingestion --------------------
+
+async def extract_record(record, pacer, max_retries):
+    """Extracts one record, retrying once the dispatcher's own retries are exhausted."""
+    calls = 1 if EXTRACTION_MODE == "structured" else 2
+    for attempt in range(max_retries + 1):
+        await pacer.wait(calls)
+        try:
+            return await extract_answer_async(record_text(record))
+        except groq.RateLimitError as e:
+            if attempt == max_retries:
+                raise
+            delay = retry_after_seconds(e, attempt)
+            print(f"⏳ Rate limited, backing off {delay:.1f}s")
+            pacer.back_off(delay)
+        except (groq.APIConnectionError, groq.InternalServerError):
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(min(60.0, 2 ** attempt) * random.uniform(0.5, 1.5))
+
+async def ingest(path, checkpoint_path, failures_path, concurrency, batch_size, rpm, max_retries):
+    start_index = load_checkpoint(checkpoint_path)
+    if start_index:
+        print(f"↩️ Resuming from record {start_index}")
+
+    pacer = Pacer(rpm)
+    semaphore = asyncio.Semaphore(concurrency)
+    finished = {}       # index -> (persons, relationships, user_id, user_name, answer), or None if skipped/failed
+    watermark = start_index
+    stats = {"stored": 0, "skipped": 0, "failed": 0}
+    started = time.monotonic()
+
+    def fail(index, record, error):
+        finished[index] = None
+        stats["failed"] += 1
+        with open(failures_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"index": index, "record": record, "error": error}) + "\n")
+
+    async def process(index, record):
+        try:
+            persons, relationships = await extract_record(record, pacer, max_retries)
+            finished[index] = ((persons, relationships, record["user_id"], record.get("name"), record_text(record))
+                               if persons and relationships else None)
+            if finished[index] is None:
+                stats["skipped"] += 1
+        except Exception as e:
+            fail(index, record, str(e))
+        finally:
+            semaphore.release()
+
+    async def flush():
+        """Writes every contiguous finished record in one transaction and advances the checkpoint."""
+        nonlocal watermark
+        items = []
+        end = watermark
+        while end in finished:
+            item = finished.pop(end)
+            if item is not None:
+                items.append(item)
+            end += 1
+        if end == watermark:
+            return
+        if items:
+            await store_many_in_neo4j_async(items)
+        stats["stored"] += len(items)
+        watermark = end
+        save_checkpoint(checkpoint_path, watermark)
+
+        elapsed = time.monotonic() - started
+        done = watermark - start_index
+        print(f"📦 {done} records ({stats['stored']} stored, {stats['skipped']} empty, {stats['failed']} failed) "
+              f"— {done / elapsed:.2f} records/s")
+
+    tasks = {}
+    for index, record, error in read_records(path):
+        if index < start_index:
+            continue
+        if error is not None:
+            # Unreadable records are reported like failed extractions, and the checkpoint moves past them
+            fail(index, record, error)
+            continue
+        await semaphore.acquire()
+        tasks[index] = asyncio.create_task(process(index, record))
+        tasks[index].add_done_callback(lambda _, index=index: tasks.pop(index, None))
+
+        # Keep write batches large; if a slow record is holding the batch back, wait for it
+        # rather than letting finished results pile up in memory
+        if len(finished) >= batch_size:
+            if watermark in tasks:
+                await tasks[watermark]
+            await flush()
+
+    await asyncio.gather(*tasks.values())
+    await flush()
+    await resources.aclose()
+
+    elapsed = time.monotonic() - started
+    total = watermark - start_index
+    print(f"\n✅ Ingested {total} records in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.2f} records/s): "
+          f"{stats['stored']} stored, {stats['skipped']} empty, {stats['failed']} failed")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="JSONL or CSV file of (user_id, answer) records")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <path>.checkpoint)")
+    parser.add_argument("--failures", help="where to append records that failed (default: <path>.failures.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=8, help="records extracted at once")
+    parser.add_argument("--batch-size", type=int, default=200, help="records per Neo4j transaction")
+    parser.add_argument("--rpm", type=float, default=30, help="LLM requests per minute (0 = unpaced)")
+    parser.add_argument("--max-retries", type=int, default=5, help="retries per record on rate limits/transient errors")
+    args = parser.parse_args()
+
+    asyncio.run(ingest(
+        args.path,
+        args.checkpoint or args.path + ".checkpoint",
+        args.failures or args.path + ".failures.jsonl",
+        args.concurrency,
+        args.batch_size,
+        args.rpm,
+        args.max_retries,
+    ))
+
+if __name__ == "__main__":
+    main()
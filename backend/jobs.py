@@ -0,0 +1,264 @@
+import os
+import json
+import asyncio
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# -------------------- Background Jobs --------------------
+# Jobs are described by a registered handler name plus a JSON-serializable
+# payload (never a Python callable), so the in-process queue below can be
+# swapped for a broker-backed JobQueue whose workers run in other processes.
+
+class PermanentJobError(Exception):
+    """Raised by a handler for failures that retrying cannot fix."""
+
+class Job:
+    def __init__(self, kind, user_id, payload):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.user_id = user_id
+        self.payload = payload
+        self.status = "queued"  # queued → running → succeeded | failed
+        self.attempts = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done = asyncio.Event()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+# -------------------- Shared Job State --------------------
+# Jobs run in the worker process that accepted them, but with `uvicorn --workers N`
+# the status poll or the story request may land on another worker. With
+# JOB_BACKEND=sqlite (the default when sessions use SQLite) every worker records
+# job state in the same SQLite file, so any of them can report a job's status
+# and wait for a user's outstanding answers.
+
+class SQLiteJobStore:
+    """Job status rows in a SQLite file shared by every worker process on the host."""
+
+    # Old finished rows are swept on every Nth save
+    PURGE_EVERY = 100
+
+    def __init__(self, path, retention=86400, stale_after=600):
+        self.retention = retention
+        # Unfinished rows not updated for this long belong to a worker that died; nobody waits on them
+        self.stale_after = stale_after
+        self.saves = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, user_id TEXT, status TEXT NOT NULL, "
+                        "job TEXT NOT NULL, updated_at REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_user_status ON jobs (user_id, status)")
+        self.db.commit()
+        # Statements block (up to the 5s busy timeout while other workers write), so they
+        # run off the event loop; one thread keeps a job's saves in the order they were made
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+
+    async def call(self, method, *args):
+        """Runs one of the methods below on the store's thread."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, method, *args)
+
+    def save(self, job):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO jobs (id, user_id, status, job, updated_at) VALUES (?, ?, ?, ?, ?)",
+                            (job.id, job.user_id, job.status, json.dumps({**job.to_dict(), "user_id": job.user_id}, default=str), time.time()))
+            self.saves += 1
+            if self.saves % self.PURGE_EVERY == 0:
+                self.db.execute("DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?",
+                                (time.time() - self.retention,))
+            self.db.commit()
+
+    def get(self, job_id):
+        """The job's to_dict() (plus its user_id), or None."""
+        with self.lock:
+            row = self.db.execute("SELECT job FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def pending(self, user_id):
+        """Unfinished jobs for user_id across all workers."""
+        with self.lock:
+            row = self.db.execute("SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status IN ('queued', 'running') AND updated_at >= ?",
+                                  (user_id, time.time() - self.stale_after)).fetchone()
+        return row[0]
+
+def make_job_store():
+    """The shared store chosen by JOB_BACKEND ("sqlite", or "memory" for this process only)."""
+    if os.getenv("JOB_BACKEND", os.getenv("SESSION_BACKEND", "memory")) == "sqlite":
+        return SQLiteJobStore(os.getenv("JOB_DB_PATH") or os.getenv("SESSION_DB_PATH", "sessions.sqlite3"),
+                              stale_after=float(os.getenv("JOB_STALE_AFTER", "600")))
+    return None
+
+class JobQueue:
+    """Interface the API talks to; implementations decide where handlers actually run."""
+
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, kind, handler):
+        """Registers the coroutine function that runs jobs of this kind."""
+        self.handlers[kind] = handler
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def submit(self, kind, user_id, payload):
+        raise NotImplementedError
+
+    async def get(self, job_id):
+        """The job's to_dict() plus its user_id, or None if unknown."""
+        raise NotImplementedError
+
+    async def wait_for_user(self, user_id, timeout=None):
+        raise NotImplementedError
+
+class LocalJobQueue(JobQueue):
+    """In-process queue drained by a bounded pool of asyncio workers, with retries.
+
+    With a shared store, job status and per-user waits also cover jobs accepted by other worker processes.
+    """
+
+    # How often wait_for_user re-checks the shared store for other workers' jobs
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, workers=4, max_size=1000, max_retries=3, base_delay=1.0, max_finished=10000, store=None):
+        super().__init__()
+        self.store = store
+        self.worker_count = workers
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()
+        self.pending_by_user = {}
+        self.workers = []
+
+    async def start(self):
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def submit(self, kind, user_id, payload):
+        """Queues a job and returns it immediately; raises asyncio.QueueFull when saturated."""
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind {kind!r}")
+
+        job = Job(kind, user_id, payload)
+        self.queue.put_nowait(job)
+        self.jobs[job.id] = job
+        self.pending_by_user.setdefault(user_id, set()).add(job.id)
+        self._trim_finished()
+        await self._save(job)
+        return job
+
+    async def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return {**job.to_dict(), "user_id": job.user_id}
+        return await self.store.call(self.store.get, job_id) if self.store is not None else None
+
+    async def wait_for_user(self, user_id, timeout=None):
+        """Waits until every job queued for user_id has finished (or the timeout passes)."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - loop.time())
+
+        pending = [self.jobs[job_id].done.wait() for job_id in self.pending_by_user.get(user_id, ())]
+        if pending:
+            try:
+                await asyncio.wait_for(asyncio.gather(*pending), remaining())
+            except asyncio.TimeoutError:
+                return False
+
+        # Jobs for the same user accepted by other workers
+        while self.store is not None and await self.store.call(self.store.pending, user_id):
+            if deadline is not None and remaining() <= 0:
+                return False
+            await asyncio.sleep(self.POLL_INTERVAL if deadline is None else min(self.POLL_INTERVAL, remaining()))
+        return True
+
+    async def _save(self, job):
+        if self.store is not None:
+            try:
+                await self.store.call(self.store.save, job)
+            except sqlite3.Error as e:
+                logger.warning("⚠️ Couldn't record job %s in the shared store: %s", job.id, e)
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job):
+        job.status = "running"
+        while True:
+            job.attempts += 1
+            await self._save(job)
+            try:
+                job.result = await self.handlers[job.kind](job.payload)
+                job.status = "succeeded"
+                break
+            except PermanentJobError as e:
+                job.error = str(e)
+                job.status = "failed"
+                break
+            except Exception as e:
+                job.error = str(e)
+                if job.attempts > self.max_retries:
+                    job.status = "failed"
+                    break
+                # Exponential backoff with jitter before the next attempt
+                delay = self.base_delay * 2 ** (job.attempts - 1)
+                logger.warning("⚠️ Job %s attempt %d failed (%s), retrying in %.1fs", job.id, job.attempts, e, delay)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+
+        job.finished_at = time.time()
+        await self._save(job)
+        pending = self.pending_by_user.get(job.user_id)
+        if pending is not None:
+            pending.discard(job.id)
+            if not pending:
+                del self.pending_by_user[job.user_id]
+        job.done.set()
+
+    def _trim_finished(self):
+        """Forgets the oldest finished jobs once more than max_finished are kept."""
+        excess = len(self.jobs) - self.max_finished
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id].done.is_set():
+                del self.jobs[job_id]
+                excess -= 1
@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import hashlib
+import logging
+import itertools
+import threading
+
+import groq
+
+import metrics
+from resources import resources  # Shared Groq clients, created on first use
+from context import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# -------------------- LLM Dispatcher --------------------
+# Every Groq call goes through one dispatcher so the process stays inside the
+# account's quota instead of finding out from 429s:
+#   - per-model requests-per-minute and tokens-per-minute token buckets,
+#   - priority lanes, so an interactive story is served before queued extraction,
+#   - retries with jittered exponential backoff that honour Retry-After,
+#   - coalescing of identical prompts that are already in flight.
+#
+# LLM_RPM / LLM_TPM set the default budget for every model (0 = unlimited);
+# LLM_RATE_LIMITS overrides it per model, e.g.
+#   LLM_RATE_LIMITS='{"llama-3.3-70b-versatile": {"rpm": 30, "tpm": 12000}}'
+
+INTERACTIVE = 0   # a user is waiting on the response (story generation)
+BACKGROUND = 1    # extraction, bulk ingestion
+
+RETRYABLE_ERRORS = (groq.RateLimitError, groq.APIConnectionError, groq.InternalServerError)
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at capacity per minute; capacity 0 means unlimited."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount can be taken (amounts above capacity only need a full bucket)."""
+        if not self.capacity:
+            return 0.0
+        self.refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        """Takes amount; a negative amount refunds an over-estimate."""
+        if self.capacity:
+            self.refill()
+            self.level = min(self.capacity, self.level - amount)
+
+class ModelLimiter:
+    """Budgets and in-flight slots for one model, granted to waiters in priority order."""
+
+    def __init__(self, rpm, tpm, max_in_flight):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.waiters = []               # heap of (priority, seq, cost, future)
+        self.sequence = itertools.count()
+        self.timer = None
+        self.lock = threading.Lock()    # sync callers (scripts) share the buckets
+
+    def delay(self, cost):
+        return max(self.paused_until - time.monotonic(), self.requests.wait_time(1), self.tokens.wait_time(cost))
+
+    def take(self, cost):
+        self.requests.take(1)
+        self.tokens.take(cost)
+
+    def pause(self, seconds):
+        """Holds every call to this model back after the API said to slow down."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, cost, priority):
+        """Waits for budget and a free slot; callers must release() afterwards."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), cost, future))
+        self.grant()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self.grant()
+
+    def grant(self):
+        """Hands budget to waiters, highest priority first; the head of the line is never skipped."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        with self.lock:
+            while self.waiters and self.in_flight < self.max_in_flight:
+                priority, _, cost, future = self.waiters[0]
+                if future.done():
+                    heapq.heappop(self.waiters)
+                    continue
+                wait = self.delay(cost)
+                if wait > 0:
+                    self.timer = asyncio.get_running_loop().call_later(wait, self.grant)
+                    return
+                heapq.heappop(self.waiters)
+                self.take(cost)
+                self.in_flight += 1
+                future.set_result(None)
+
+    def acquire_sync(self, cost):
+        """Blocking acquire for scripts; it shares the buckets but not the priority queue."""
+        while True:
+            with self.lock:
+                wait = self.delay(cost)
+                if wait <= 0:
+                    self.take(cost)
+                    return
+            time.sleep(wait)
+
+def retry_after_seconds(error, attempt):
+    """Honours the Retry-After header when Groq sends one, else exponential backoff with jitter."""
+    response = getattr(error, "response", None)
+    header = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(header)
+    except (TypeError, ValueError):
+        return min(60.0, 2 ** attempt) * random.uniform(0.5, 1.5)
+
+def as_messages(prompt):
+    """Chat messages for prompt: a rendered message list, or a bare string sent as one user message."""
+    return [{"role": "user", "content": prompt}] if isinstance(prompt, str) else prompt
+
+def stream_usage(chunk):
+    """Token usage carried by a streamed chunk, if any (Groq sends it on the last one)."""
+    x_groq = getattr(chunk, "x_groq", None)
+    return getattr(x_groq, "usage", None) or getattr(chunk, "usage", None)
+
+class LLMDispatcher:
+    def __init__(self):
+        self.default_rpm = int(os.getenv("LLM_RPM", "0"))
+        self.default_tpm = int(os.getenv("LLM_TPM", "0"))
+        self.model_limits = json.loads(os.getenv("LLM_RATE_LIMITS") or "{}")
+        # Upper bound on requests kept in flight at once per model by this worker
+        self.max_in_flight = int(os.getenv("MAX_CONCURRENT_LLM_CALLS", "32"))
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "4"))
+        # Completion tokens charged up front when the call doesn't set max_tokens; corrected from usage afterwards
+        self.completion_estimate = int(os.getenv("LLM_COMPLETION_ESTIMATE", "512"))
+        self.limiters = {}
+        self.pending = {}  # coalescing key -> task for identical in-flight prompts
+
+    def limiter(self, model):
+        if model not in self.limiters:
+            limits = self.model_limits.get(model, {})
+            self.limiters[model] = ModelLimiter(limits.get("rpm", self.default_rpm),
+                                                limits.get("tpm", self.default_tpm), self.max_in_flight)
+        return self.limiters[model]
+
+    def cost(self, messages, kwargs):
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        return prompt_tokens + (kwargs.get("max_tokens") or self.completion_estimate)
+
+    def settle(self, limiter, cost, usage):
+        """Replaces the up-front token estimate with what the call actually used."""
+        if usage is not None and usage.total_tokens:
+            limiter.tokens.take(usage.total_tokens - cost)
+
+    def should_retry(self, error, attempt, limiter, model, kind):
+        """Decides whether to retry and returns the backoff delay (or None to give up)."""
+        if not isinstance(error, RETRYABLE_ERRORS) or attempt >= self.max_retries:
+            metrics.LLM_ERRORS.inc(model=model, kind=kind)
+            return None
+        delay = retry_after_seconds(error, attempt)
+        if isinstance(error, groq.RateLimitError):
+            limiter.pause(delay)
+        metrics.LLM_RETRIES.inc(model=model, kind=kind)
+        logger.warning("⏳ %s call to %s failed (%s), retry %d in %.1fs", kind, model, type(error).__name__, attempt + 1, delay)
+        return delay
+
+    # -------------------- Async --------------------
+
+    async def complete(self, prompt, model, kind, priority=BACKGROUND, **kwargs):
+        """Returns the completion text; identical concurrent prompts share one request.
+
+        prompt is a string or a list of chat messages (as rendered by prompts.py).
+        """
+        messages = as_messages(prompt)
+        key = hashlib.sha256(json.dumps([model, messages, kwargs], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        task = self.pending.get(key)
+        if task is not None:
+            metrics.LLM_COALESCED.inc(model=model, kind=kind)
+        else:
+            task = asyncio.ensure_future(self._complete(messages, model, kind, priority, kwargs))
+            self.pending[key] = task
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        # One caller giving up must not cancel the request for the others
+        return await asyncio.shield(task)
+
+    async def _complete(self, messages, model, kind, priority, kwargs):
+        limiter = self.limiter(model)
+        cost = self.cost(messages, kwargs)
+        for attempt in itertools.count():
+            queued = time.perf_counter()
+            await limiter.acquire(cost, priority)
+            metrics.LLM_QUEUE_WAIT.observe(time.perf_counter() - queued, model=model, kind=kind)
+            started = time.perf_counter()
+            try:
+                response = await resources.async_llm.chat.completions.create(
+                    messages=messages,
+                    model=model,
+                    stream=False,
+                    **kwargs,
+                )
+            except Exception as e:
+                delay = self.should_retry(e, attempt, limiter, model, kind)
+                if delay is None:
+                    raise
+                if not isinstance(e, groq.RateLimitError):
+                    await asyncio.sleep(delay)
+                continue
+            finally:
+                limiter.release()
+            self.settle(limiter, cost, response.usage)
+            metrics.observe_llm(model, kind, started, response.usage)
+            return response.choices[0].message.content
+
+    async def stream(self, prompt, model, kind, priority=INTERACTIVE, **kwargs):
+        """Yields content deltas as they arrive; only failures before the first delta are retried."""
+        messages = as_messages(prompt)
+        limiter = self.limiter(model)
+        cost = self.cost(messages, kwargs)
+        for attempt in itertools.count():
+            queued = time.perf_counter()
+            await limiter.acquire(cost, priority)
+            metrics.LLM_QUEUE_WAIT.observe(time.perf_counter() - queued, model=model, kind=kind)
+            started = time.perf_counter()
+            usage = None
+            yielded = False
+            try:
+                stream = await resources.async_llm.chat.completions.create(
+                    messages=messages,
+                    model=model,
+                    stream=True,
+                    **kwargs,
+                )
+                async for chunk in stream:
+                    usage = stream_usage(chunk) or usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yielded = True
+                        yield delta
+            except Exception as e:
+                delay = None if yielded else self.should_retry(e, attempt, limiter, model, kind)
+                if delay is None:
+                    if yielded:
+                        metrics.LLM_ERRORS.inc(model=model, kind=kind)
+                    raise
+                if not isinstance(e, groq.RateLimitError):
+                    await asyncio.sleep(delay)
+                continue
+            finally:
+                limiter.release()
+            self.settle(limiter, cost, usage)
+            metrics.observe_llm(model, kind, started, usage)
+            return
+
+    # -------------------- Sync (scripts) --------------------
+
+    def complete_sync(self, prompt, model, kind, **kwargs):
+        """Blocking variant of complete for scripts; shares budgets and retry policy."""
+        messages = as_messages(prompt)
+        limiter = self.limiter(model)
+        cost = self.cost(messages, kwargs)
+        for attempt in itertools.count():
+            limiter.acquire_sync(cost)
+            started = time.perf_counter()
+            try:
+                response = resources.llm.chat.completions.create(
+                    messages=messages,
+                    model=model,
+                    stream=False,
+                    **kwargs,
+                )
+            except Exception as e:
+                delay = self.should_retry(e, attempt, limiter, model, kind)
+                if delay is None:
+                    raise
+                if not isinstance(e, groq.RateLimitError):
+                    time.sleep(delay)
+                continue
+            self.settle(limiter, cost, response.usage)
+            metrics.observe_llm(model, kind, started, response.usage)
+            return response.choices[0].message.content
+
+dispatcher = LLMDispatcher()
@@ -0,0 +1,44 @@
+import os
+import queue
+import random
+import logging
+import logging.handlers
+
+# -------------------- Logging --------------------
+# Records are handed to a queue and written to stderr by a background thread,
+# so logging never blocks the event loop on terminal or pipe I/O.
+# LOG_SAMPLE_RATE keeps only a fraction of DEBUG/INFO records under load;
+# warnings and errors are always kept.
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+listener = None
+
+def configure_logging():
+    """Installs the queue-backed root handler once; later calls are no-ops."""
+    global listener
+    if listener is not None:
+        return
+
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    rate = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(SamplingFilter(rate))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+
+    listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    listener.start()
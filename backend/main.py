@@ -26,15 +26,67 @@
 #     main()
 
 
-from fastapi import FastAPI
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Depends, Header
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from extractData import extract_people, extract_relationships_and_emotions
-from pushneo4j import store_in_neo4j
-from fetchfromdb import fetch_all_data
-from storygen import generate_uplifting_story
+import extractData
+from extractData import extract_answer_async, extract_answers_async, extract_people_async, stream_relationships_async, build_full_text, unique_names
+from pushneo4j import store_in_neo4j_async, store_many_in_neo4j_async, store_stream_in_neo4j_async
+from storygen import get_uplifting_story_async, speculate_story, stream_uplifting_story
+from export import export_ndjson_async, EXPORT_FETCH_SIZE
+from context import dedupe_facts
+from dbconnect import bootstrap_schema, test_connection
+from resources import resources
+from jobs import LocalJobQueue, PermanentJobError, make_job_store
+from sessions import make_session_store
+from logsetup import configure_logging
+import metrics
+import prompts
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# ✅ Background answer processing (opt-in per request with `background: true`)
+job_queue = LocalJobQueue(
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+    max_size=int(os.getenv("JOB_QUEUE_SIZE", "1000")),
+    max_retries=int(os.getenv("JOB_MAX_RETRIES", "3")),
+    store=make_job_store(),  # shared with the other uvicorn workers when sessions use SQLite
+)
+
+# How long /generate-story/ waits for the user's outstanding answer jobs
+JOB_WAIT_TIMEOUT = float(os.getenv("JOB_WAIT_TIMEOUT", "60"))
+
+# Start generating the story as soon as the answer marked `final` is stored
+SPECULATIVE_STORIES = os.getenv("SPECULATIVE_STORIES", "1") == "1"
+speculation_tasks = set()
+
+@asynccontextmanager
+async def lifespan(app):
+    # ✅ Clients are created lazily on first use; the schema bootstrap runs in the
+    # background so startup never waits on (or fails because of) Neo4j
+    schema_task = asyncio.create_task(bootstrap_schema())
+    # The tokenizer may download its BPE file, so it loads in a thread; prompts are estimated until then
+    encoding_task = asyncio.create_task(asyncio.to_thread(prompts.load_encoding))
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    for task in speculation_tasks:
+        task.cancel()
+    schema_task.cancel()
+    encoding_task.cancel()
+    await resources.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 # ✅ Allow frontend to send requests to backend
 app.add_middleware(
@@ -45,79 +97,328 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ✅ Store user info globally (temporary storage)
-user_info = {}
+# ✅ Per-endpoint latency for /metrics
+@app.middleware("http")
+async def record_request_latency(request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.HTTP_LATENCY.observe(time.perf_counter() - started, method=request.method,
+                                 path=route.path if route else "unmatched", status=response.status_code)
+    return response
+
+# ✅ Prometheus scrape endpoint
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# ✅ Per-user session state, keyed by the token /store-user/ hands out
+session_store = make_session_store()
+
+# A plain def, so FastAPI runs it in its threadpool and the store's SQLite calls don't block the event loop
+def current_user(x_session_token: Optional[str] = Header(None), session: Optional[str] = None):
+    """The user behind the request's session token (header, or ?session= for EventSource), if any."""
+    token = x_session_token or session
+    return session_store.get(token) if token else None
+
+SESSION_MISSING = {"error": "User info is missing. Please start from the beginning."}
+
+# Clients from before sessions picked their own user_id (in /store-user/, answer bodies and
+# ?user_id=). Anyone can send any id that way, so it stays off unless a migration needs it.
+ALLOW_CLIENT_USER_ID = os.getenv("ALLOW_CLIENT_USER_ID", "0") == "1"
+
+# ✅ Liveness/readiness check (replaces the old connection test at import time)
+@app.get("/healthz")
+async def healthz():
+    neo4j_ok = await test_connection()
+    status = {"status": "ok" if neo4j_ok else "degraded", "neo4j": "ok" if neo4j_ok else "unreachable"}
+    return JSONResponse(status_code=200 if neo4j_ok else 503, content=status)
 
 # ✅ Define request body format
 class UserInfo(BaseModel):
     name: str
     age: str
     gender: str
+    user_id: Optional[str] = None  # Ignored unless ALLOW_CLIENT_USER_ID; /store-user/ issues it
 
 class UserInput(BaseModel):
     text: str
 
 class AnswerInput(BaseModel):
     text: str
-    user_info: UserInfo
+    user_info: Optional[UserInfo] = None  # Only read without a session token, if ALLOW_CLIENT_USER_ID
+    background: bool = False  # Return 202 + job id right away and process on the worker pool
+    final: bool = False  # Last answer of the questionnaire: the story can be generated ahead of the request
+
+class AnswersInput(BaseModel):
+    answers: list[str]
+    user_info: Optional[UserInfo] = None
+    background: bool = False
+    final: bool = False
+
+# Upper bound on answers accepted by one /process-answers/ request
+MAX_BATCH_ANSWERS = int(os.getenv("MAX_BATCH_ANSWERS", "20"))
+
+def request_user(session_user, input_data):
+    """The session's user; details sent in the body only count for legacy clients (ALLOW_CLIENT_USER_ID)."""
+    if (ALLOW_CLIENT_USER_ID and session_user is None
+            and input_data.user_info is not None and input_data.user_info.user_id):
+        return input_data.user_info.dict()
+    return session_user
+
+def request_user_id(session_user, user_id=None):
+    """The session's user_id; a ?user_id= parameter only counts for legacy clients (ALLOW_CLIENT_USER_ID)."""
+    if session_user is not None:
+        return session_user["user_id"]
+    return user_id if ALLOW_CLIENT_USER_ID else None
 
 @app.post("/store-user/")
 async def store_user(input_data: UserInfo):
-    global user_info
     user_info = input_data.dict()
-    print("✅ User info stored:", user_info)  # Debugging
-    return {"message": "User info stored successfully!", "user_info": user_info}
+    # The server picks the id; the session token is the only way to act as this user afterwards
+    user_info["user_id"] = (ALLOW_CLIENT_USER_ID and input_data.user_id) or uuid.uuid4().hex
+    token = await asyncio.to_thread(session_store.create, user_info)
+    logger.debug("✅ User info stored: %s", user_info)
+    return {"message": "User info stored successfully!", "user_info": user_info,
+            "user_id": user_info["user_id"], "session_token": token}
 
 
 # ✅ Endpoint to store user info from `UserInfo.tsx`
 @app.post("/process-answer/")
-async def process_answer(input_data: AnswerInput):
-    print("\n🟢 process_answer() STARTED!")  
-    print("\n📩 Raw Request Data:", input_data.dict())  # Debugging
+async def process_answer(input_data: AnswerInput, user_info=Depends(current_user)):
+    logger.debug("📩 Raw Request Data: %s", input_data.dict())
 
-    global user_info
-    if not user_info:
-        print("❌ ERROR: User info is missing!")
-        return {"error": "User info is missing. Please start from the beginning."}
+    user_info = request_user(user_info, input_data)
+    if user_info is None:
+        logger.warning("❌ User info is missing!")
+        return JSONResponse(status_code=401, content=SESSION_MISSING)
+
+    full_text = build_full_text(user_info, input_data.text)
+    user_id = user_info["user_id"]
+    logger.debug("🔍 Full Text Input for Extraction: %s", full_text)
+    payload = {"full_text": full_text, "user_id": user_id, "user_name": user_info["name"], "final": input_data.final}
 
-    print("\n📝 Received User Info:", user_info)
-    print("\n📥 Received User Input:", input_data.text)  # Should print the text
+    if input_data.background:
+        try:
+            job = await job_queue.submit("process_answer", user_id, payload)
+        except asyncio.QueueFull:
+            return JSONResponse(status_code=503, content={"error": "Too many answers queued, please retry shortly."})
+        return JSONResponse(status_code=202, content={"job_id": job.id, "status": job.status})
 
     try:
-        full_text = f"{user_info['name']} ({user_info['age']}, {user_info['gender']}): {input_data.text}"
-        print("\n🔍 Full Text Input for Extraction:\n", full_text)
+        result = await run_answer_pipeline(payload)
+        return {"message": "Processed successfully!", "user_info": user_info, **result}
+
+    except PermanentJobError as e:
+        logger.info("❌ %s", e)
+        return {"error": str(e)}
+    except Exception as e:
+        logger.exception("❌ Error in processing answer")
+        return {"error": str(e)}
+
+
+def schedule_story(payload):
+    """After the final answer is stored, starts the story once the user's other queued answers are in too."""
+    if not (SPECULATIVE_STORIES and payload.get("final")):
+        return
+
+    async def speculate():
+        try:
+            await job_queue.wait_for_user(payload["user_id"], JOB_WAIT_TIMEOUT)
+            await speculate_story(payload["user_id"], payload.get("user_name"))
+        except Exception as e:
+            logger.warning("⚠️ Could not start the story early: %s", e)
+
+    task = asyncio.create_task(speculate())
+    speculation_tasks.add(task)
+    task.add_done_callback(speculation_tasks.discard)
+
+
+async def run_answer_pipeline(payload):
+    """Extracts persons and relationships from one answer and stores them in the user's graph."""
+    full_text = payload["full_text"]
+
+    if extractData.EXTRACTION_MODE == "streaming":
+        return await run_streaming_answer_pipeline(payload)
+
+    with metrics.stage("process_answer", "extract"):
+        persons, relationships = await extract_answer_async(full_text)
+    logger.debug("👥 Identified Persons: %s", persons)
+    logger.debug("🔗 Extracted Relationships & Emotions: %s", relationships)
+
+    if not persons or not relationships:
+        logger.info("❌ No persons or relationships extracted! Skipping Neo4j storage.")
+        raise PermanentJobError("No meaningful data extracted.")
 
-        persons = extract_people(full_text)
-        print("👥 Identified Persons:", persons)
+    with metrics.stage("process_answer", "store"):
+        persons, relationships = await store_in_neo4j_async(persons, relationships, payload["user_id"], payload.get("user_name"),
+                                                            answer=full_text)
+    logger.info("✅ Stored %d persons and %d relationships", len(persons), len(relationships))
+    schedule_story(payload)
 
-        relationships = extract_relationships_and_emotions(full_text, persons)
-        print("\n🔗 Extracted Relationships & Emotions:", relationships)
+    return {"full_text": full_text, "persons": persons, "relationships": relationships}
 
-        if not persons or not relationships:
-            print("❌ ERROR: No persons or relationships extracted! Skipping Neo4j storage.")
-            return {"error": "No meaningful data extracted."}
+async def run_streaming_answer_pipeline(payload):
+    """Like run_answer_pipeline, but writes triples to Neo4j while the model is still generating them."""
+    full_text = payload["full_text"]
 
-        store_in_neo4j(persons, relationships)
-        print("\n✅ Data successfully pushed to Neo4j!")
+    with metrics.stage("process_answer", "extract_people"):
+        persons = await extract_people_async(full_text)
+    logger.debug("👥 Identified Persons: %s", persons)
+    if not persons:
+        logger.info("❌ No persons extracted! Skipping Neo4j storage.")
+        raise PermanentJobError("No meaningful data extracted.")
 
-        return {
-            "message": "Processed successfully!",
-            "user_info": user_info,
-            "full_text": full_text,
-            "persons": persons,
-            "relationships": relationships
-        }
+    with metrics.stage("process_answer", "stream_extract_and_store"):
+        relationships = await store_stream_in_neo4j_async(
+            persons, stream_relationships_async(full_text, persons), payload["user_id"], payload.get("user_name"),
+            answer=full_text)
+    logger.debug("🔗 Extracted Relationships & Emotions: %s", relationships)
 
+    if not relationships:
+        logger.info("❌ No relationships extracted! Nothing was stored.")
+        raise PermanentJobError("No meaningful data extracted.")
+
+    logger.info("✅ Stored %d persons and %d relationships", len(persons), len(relationships))
+    schedule_story(payload)
+    return {"full_text": full_text, "persons": persons, "relationships": relationships}
+
+job_queue.register("process_answer", run_answer_pipeline)
+
+
+# ✅ Batch endpoint: the whole questionnaire (or a chunk of it) in one request
+@app.post("/process-answers/")
+async def process_answers(input_data: AnswersInput, user_info=Depends(current_user)):
+    user_info = request_user(user_info, input_data)
+    if user_info is None:
+        logger.warning("❌ User info is missing!")
+        return JSONResponse(status_code=401, content=SESSION_MISSING)
+
+    answers = [answer for answer in input_data.answers if answer.strip()]
+    if not answers:
+        return JSONResponse(status_code=422, content={"error": "No answers to process."})
+    if len(answers) > MAX_BATCH_ANSWERS:
+        return JSONResponse(status_code=422, content={"error": f"At most {MAX_BATCH_ANSWERS} answers per request."})
+
+    payload = {"user": {key: user_info[key] for key in ("name", "age", "gender")}, "answers": answers,
+               "user_id": user_info["user_id"], "user_name": user_info["name"], "final": input_data.final}
+
+    if input_data.background:
+        try:
+            job = await job_queue.submit("process_answers", payload["user_id"], payload)
+        except asyncio.QueueFull:
+            return JSONResponse(status_code=503, content={"error": "Too many answers queued, please retry shortly."})
+        return JSONResponse(status_code=202, content={"job_id": job.id, "status": job.status})
+
+    try:
+        result = await run_answers_pipeline(payload)
+        return {"message": "Processed successfully!", "user_info": user_info, **result}
+
+    except PermanentJobError as e:
+        logger.info("❌ %s", e)
+        return {"error": str(e)}
     except Exception as e:
-        print("❌ ERROR in processing answer:", str(e))
+        logger.exception("❌ Error in processing answers")
         return {"error": str(e)}
 
 
+async def run_answers_pipeline(payload):
+    """Extracts a batch of answers together and stores everything in one write transaction."""
+    with metrics.stage("process_answers", "extract"):
+        persons, extracted = await extract_answers_async(payload["user"], payload["answers"])
+    logger.debug("👥 Identified Persons: %s", persons)
+    logger.debug("🔗 Extracted Relationships & Emotions: %s", extracted)
+
+    # Each answer is stored under its own full text, the key /process-answer/ would give it too
+    items = [(persons, relationships, payload["user_id"], payload.get("user_name"), full_text)
+             for full_text, relationships in extracted if relationships]
+    if not persons or not items:
+        logger.info("❌ No persons or relationships extracted! Skipping Neo4j storage.")
+        raise PermanentJobError("No meaningful data extracted.")
+
+    with metrics.stage("process_answers", "store"):
+        stored = await store_many_in_neo4j_async(items)
+    persons = unique_names(person for item in stored for person in item[0])
+    relationships = dedupe_facts([rel for item in stored for rel in item[1]])
+    logger.info("✅ Stored %d persons and %d relationships from %d answers", len(persons), len(relationships), len(payload["answers"]))
+    schedule_story(payload)
+
+    return {"answers": len(payload["answers"]), "persons": persons, "relationships": relationships}
+
+job_queue.register("process_answers", run_answers_pipeline)
+
+
+# ✅ Status of a background answer job
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, user_info=Depends(current_user)):
+    if user_info is None and not ALLOW_CLIENT_USER_ID:
+        return JSONResponse(status_code=401, content=SESSION_MISSING)
+    job = await job_queue.get(job_id)
+    # Results hold the user's extracted data, so other users' jobs look unknown
+    if job is None or (user_info is not None and job["user_id"] != user_info["user_id"]):
+        return JSONResponse(status_code=404, content={"error": "Unknown job id."})
+    return {key: value for key, value in job.items() if key != "user_id"}
+
+
+def user_name_for(user_info, user_id):
+    """Name of the session's user, if user_id belongs to them (helps rank facts around their node)."""
+    return user_info["name"] if user_info and user_info["user_id"] == user_id else None
+
+
 # ✅ Endpoint to generate final story
 @app.get("/generate-story/")
-async def generate_story():
-    """Fetches extracted data from Neo4j and generates an uplifting story."""
-    data = fetch_all_data()
-    story = generate_uplifting_story()  # Use fetched data for story generation
+async def generate_story(user_id: Optional[str] = None, user_info=Depends(current_user)):
+    """Fetches the user's extracted data from Neo4j and generates an uplifting story."""
+    user_id = request_user_id(user_info, user_id)
+    if not user_id:
+        return JSONResponse(status_code=401, content=SESSION_MISSING)
+
+    # ✅ Answers submitted in the background must be in the graph before the story is written
+    with metrics.stage("generate_story", "wait_for_jobs"):
+        await job_queue.wait_for_user(user_id, JOB_WAIT_TIMEOUT)
+
+    with metrics.stage("generate_story", "generate"):
+        story = await get_uplifting_story_async(user_id, user_name_for(user_info, user_id))  # Cached until the graph changes
     return {"story": story}
 
+
+# ✅ Streaming variant: relays story tokens as Server-Sent Events as they arrive
+@app.get("/generate-story/stream")
+async def generate_story_stream(user_id: Optional[str] = None, user_info=Depends(current_user)):
+    """Streams the uplifting story as SSE `data:` events, then a final `done` event."""
+    user_id = request_user_id(user_info, user_id)
+
+    async def events():
+        if not user_id:
+            yield f"event: error\ndata: {json.dumps(SESSION_MISSING)}\n\n"
+            return
+        try:
+            await job_queue.wait_for_user(user_id, JOB_WAIT_TIMEOUT)
+            async for text in stream_uplifting_story(user_id, user_name_for(user_info, user_id)):
+                yield f"data: {json.dumps({'text': text})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            logger.exception("❌ Error while streaming story")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ✅ Backup / inspection: the session user's triples as NDJSON, streamed straight from the driver
+# (other users' graphs are only exported from the CLI: python export.py --user USER_ID)
+@app.get("/graph/export")
+async def export_graph(after: str = "", limit: Optional[int] = None, fetch_size: int = EXPORT_FETCH_SIZE,
+                       user_info=Depends(current_user)):
+    """Streams the session user's triples, one JSON object per line; resume with ?after=<last cursor>."""
+    if not user_info:
+        return JSONResponse(status_code=401, content=SESSION_MISSING)
+
+    return StreamingResponse(
+        export_ndjson_async(user_info["user_id"], after, limit if limit is None else max(0, limit), max(1, fetch_size)),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
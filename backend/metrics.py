@@ -0,0 +1,136 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# -------------------- Prometheus Metrics --------------------
+# A small dependency-free registry that renders the Prometheus text format
+# served by GET /metrics.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+ROW_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 500, 1000, 10000)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels)
+    return "{" + pairs + "}"
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{format_labels(key)} {format_value(value)}")
+        return lines
+
+class Gauge:
+    """Gauge whose samples come from a callback at scrape time."""
+
+    def __init__(self, name, documentation, collect):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect  # returns {labels tuple: value}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in self.collect().items():
+            lines.append(f"{self.name}{format_labels(key)} {format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self.lock:
+            series = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in self.series.items():
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', format_value(bound)),))} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {format_value(series[-2])}")
+                lines.append(f"{self.name}_count{format_labels(key)} {series[-1]}")
+        return lines
+
+REGISTRY = []
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+def render():
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# -------------------- Application Metrics --------------------
+
+LLM_LATENCY = register(Histogram("llm_request_duration_seconds", "LLM call latency.", ("model", "kind")))
+LLM_PROMPT_TOKENS = register(Histogram("llm_prompt_tokens", "Prompt tokens per LLM call.", ("model", "kind"), TOKEN_BUCKETS))
+LLM_COMPLETION_TOKENS = register(Histogram("llm_completion_tokens", "Completion tokens per LLM call.", ("model", "kind"), TOKEN_BUCKETS))
+PROMPT_SEGMENT_TOKENS = register(Histogram("prompt_segment_tokens", "Locally counted tokens per prompt segment.",
+                                           ("prompt", "version", "segment"), TOKEN_BUCKETS))
+LLM_ERRORS = register(Counter("llm_request_errors_total", "LLM calls that failed after retries.", ("model", "kind")))
+LLM_RETRIES = register(Counter("llm_request_retries_total", "LLM calls retried after a rate limit or transient error.", ("model", "kind")))
+LLM_COALESCED = register(Counter("llm_requests_coalesced_total", "LLM calls served by an identical request already in flight.", ("model", "kind")))
+LLM_QUEUE_WAIT = register(Histogram("llm_queue_wait_seconds", "Time spent waiting for rate-limit budget.", ("model", "kind")))
+
+QUERY_LATENCY = register(Histogram("neo4j_query_duration_seconds", "Neo4j statement latency.", ("kind",)))
+QUERY_ROWS = register(Histogram("neo4j_query_rows", "Rows written or read per Neo4j statement.", ("kind",), ROW_BUCKETS))
+
+STAGE_LATENCY = register(Histogram("stage_duration_seconds", "Latency of each endpoint stage.", ("endpoint", "stage")))
+HTTP_LATENCY = register(Histogram("http_request_duration_seconds", "HTTP request latency.", ("method", "path", "status")))
+
+def observe_llm(model, kind, started, usage=None):
+    """Records one LLM call; usage is the response's usage object, when the provider sent one."""
+    LLM_LATENCY.observe(time.perf_counter() - started, model=model, kind=kind)
+    if usage is not None:
+        LLM_PROMPT_TOKENS.observe(usage.prompt_tokens or 0, model=model, kind=kind)
+        LLM_COMPLETION_TOKENS.observe(usage.completion_tokens or 0, model=model, kind=kind)
+
+def observe_query(kind, rows, started):
+    """Records one Neo4j statement."""
+    QUERY_LATENCY.observe(time.perf_counter() - started, kind=kind)
+    QUERY_ROWS.observe(rows, kind=kind)
+
+@contextmanager
+def stage(endpoint, name):
+    """Times a block as one stage of an endpoint."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, stage=name)
@@ -0,0 +1,173 @@
+"""Materialized per-user mood summaries.
+
+Every write that stores a Feeling / State of Mind / Concern / Tone relation
+also updates the user's summary in the same transaction: one
+(:MoodItem {user_id, kind, name}) node per emotion, concern or tone, linked
+from the user's :UserGraph node, which also holds the latest tone. Story
+generation reads the summary with one indexed lookup instead of bucketing
+every Person triple.
+
+Each relation counts the distinct answers that stated it (see
+pushneo4j.relationship_query: a double-submit changes nothing), and the
+statement that counts a new mention of a mood relation adds that same mention
+to its MoodItem, so a write costs the rows it writes, not the size of the
+graph. The latest tone is the most recent Tone relation, or the most recent
+emotion for users without one.
+
+Summaries for data written before they existed (or after manual edits) are
+recomputed from the graph with:
+
+    python mood.py                 # every user
+    python mood.py --user USER_ID  # one user
+"""
+import time
+import asyncio
+import argparse
+
+import metrics
+from resources import resources  # Lazily-created, shared Neo4j drivers
+from context import EMOTION_RELATIONS, CONCERN_RELATIONS, TONE_RELATIONS
+
+MOOD_RELATIONS = {"emotion": EMOTION_RELATIONS, "concern": CONCERN_RELATIONS, "tone": TONE_RELATIONS}
+
+# -------------------- Write Path --------------------
+
+# Appended to the relationship statement of a mood relation, after it has
+# filtered out the rows whose answer the relation already counted: every row
+# left is one new mention, so it adds exactly one to the MoodItem.
+MOOD_INCREMENT = """
+    MERGE (g:UserGraph {{user_id: $user_id}})
+    MERGE (m:MoodItem {{user_id: $user_id, kind: '{kind}', name: b.name}})
+    ON CREATE SET m.count = 0, m.first_seen = timestamp()
+    SET m.count = coalesce(m.count, 0) + 1, m.last_seen = timestamp(), m.key = b.key
+    MERGE (g)-[:HAS_MOOD]->(m)
+"""
+
+# Runs after the relations of the same transaction are written. A tone row only
+# replaces the latest tone if it was seen at least as recently, and an emotion
+# row only while the user has no Tone relation at all.
+TONE_WRITE_QUERY = """
+MATCH (g:UserGraph {user_id: $user_id})
+UNWIND $rows AS row
+MATCH (m:MoodItem {user_id: $user_id, kind: row.kind, key: row.key})
+WITH g, row, m
+WHERE m.last_seen >= coalesce(g.tone_updated, 0)
+  AND (row.kind = 'tone' OR coalesce(g.tone_kind, 'emotion') = 'emotion')
+SET g.latest_tone = m.name, g.tone_updated = m.last_seen, g.tone_kind = row.kind
+"""
+
+def mood_kind(relation):
+    for kind, relations in MOOD_RELATIONS.items():
+        if relation in relations:
+            return kind
+    return None
+
+def mood_increment(relation):
+    """The MoodItem update for a Person relation, or "" if it isn't a mood relation."""
+    kind = mood_kind(relation)
+    return MOOD_INCREMENT.format(kind=kind) if kind else ""
+
+def tone_rows(moods):
+    """The latest tone row of one answer, from its (kind, target key) mood mentions in order: its last tone, else its last emotion."""
+    for kind in ("tone", "emotion"):
+        keys = [key for mention_kind, key in moods if mention_kind == kind]
+        if keys:
+            return [{"kind": kind, "key": keys[-1]}]
+    return []
+
+# -------------------- Read Path --------------------
+
+MOOD_READ_QUERY = """
+OPTIONAL MATCH (g:UserGraph {user_id: $user_id})
+OPTIONAL MATCH (m:MoodItem {user_id: $user_id})
+WITH g, m ORDER BY m.last_seen DESC, m.count DESC
+RETURN g.latest_tone AS latest_tone, collect(m {.kind, .name, .count, .last_seen}) AS items
+"""
+
+def to_summary(record):
+    """Splits the summary row into emotions and concerns (most recent first) plus the latest tone."""
+    items = record["items"] if record else []
+    return {
+        "emotions": [item for item in items if item["kind"] == "emotion"],
+        "concerns": [item for item in items if item["kind"] == "concern"],
+        "latest_tone": record["latest_tone"] if record else None,
+    }
+
+def fetch_mood_summary(user_id):
+    """The user's materialized mood summary."""
+    started = time.perf_counter()
+    with resources.driver.session() as session:
+        record = session.run(MOOD_READ_QUERY, user_id=user_id).single()
+    metrics.observe_query("read_mood", 1, started)
+    return to_summary(record)
+
+async def fetch_mood_summary_async(user_id):
+    """Async variant of fetch_mood_summary."""
+    started = time.perf_counter()
+    async with resources.async_driver.session() as session:
+        result = await session.run(MOOD_READ_QUERY, user_id=user_id)
+        record = await result.single()
+    metrics.observe_query("read_mood", 1, started)
+    return to_summary(record)
+
+# -------------------- Rebuild --------------------
+
+USERS_QUERY = "MATCH (p:Person) WHERE p.user_id IS NOT NULL RETURN DISTINCT p.user_id AS user_id"
+
+CLEAR_QUERY = "MATCH (m:MoodItem {user_id: $user_id}) DETACH DELETE m"
+
+CLEAR_TONE_QUERY = "MATCH (g:UserGraph {user_id: $user_id}) REMOVE g.latest_tone, g.tone_updated, g.tone_kind"
+
+# Recomputes the totals the writes keep incrementally, over every mood relation
+# at once; only needed for repair. Relations written before they carried
+# counts count once, seen now.
+REBUILD_QUERY = """
+MATCH (p:Person {user_id: $user_id})-[r]->(t)
+WHERE type(r) IN $emotion_relations OR type(r) IN $concern_relations OR type(r) IN $tone_relations
+WITH CASE WHEN type(r) IN $emotion_relations THEN 'emotion'
+          WHEN type(r) IN $concern_relations THEN 'concern' ELSE 'tone' END AS kind,
+     t.name AS name, t.key AS key, r
+WITH kind, name, min(key) AS key, sum(coalesce(r.mentions, 1)) AS mentions,
+     min(coalesce(r.first_seen, timestamp())) AS first_seen,
+     max(coalesce(r.last_seen, timestamp())) AS last_seen
+MERGE (g:UserGraph {user_id: $user_id})
+MERGE (m:MoodItem {user_id: $user_id, kind: kind, name: name})
+SET m.count = mentions, m.first_seen = first_seen, m.last_seen = last_seen, m.key = key
+MERGE (g)-[:HAS_MOOD]->(m)
+WITH g, kind, name, last_seen ORDER BY CASE kind WHEN 'tone' THEN 0 ELSE 1 END, last_seen DESC
+WITH g, collect(CASE WHEN kind <> 'concern' THEN {name: name, kind: kind, seen: last_seen} END)[0] AS latest
+SET g.latest_tone = latest.name, g.tone_updated = latest.seen, g.tone_kind = latest.kind
+"""
+
+async def rebuild_user(tx, user_id):
+    await (await tx.run(CLEAR_QUERY, user_id=user_id)).consume()
+    await (await tx.run(CLEAR_TONE_QUERY, user_id=user_id)).consume()
+    await (await tx.run(REBUILD_QUERY, user_id=user_id,
+                        emotion_relations=sorted(EMOTION_RELATIONS),
+                        concern_relations=sorted(CONCERN_RELATIONS),
+                        tone_relations=sorted(TONE_RELATIONS))).consume()
+
+async def rebuild(user_id=None):
+    """Recomputes the summaries of one user, or of every user, one transaction per user."""
+    async with resources.async_driver.session() as session:
+        if user_id:
+            user_ids = [user_id]
+        else:
+            result = await session.run(USERS_QUERY)
+            user_ids = [record["user_id"] async for record in result]
+
+        for index, uid in enumerate(user_ids, 1):
+            await session.execute_write(rebuild_user, uid)
+            print(f"🔁 Rebuilt mood summary {index}/{len(user_ids)}: {uid}")
+
+    await resources.aclose()
+    print(f"✅ Rebuilt {len(user_ids)} mood summaries")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", help="only rebuild this user_id")
+    args = parser.parse_args()
+    asyncio.run(rebuild(args.user))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Versioned prompt templates.
+
+Every prompt is registered once as a PromptTemplate: a static system segment
+(instructions, format rules, examples) and a user segment holding only the
+per-call data, rendered last. Keeping the long static part byte-identical at
+the front of every request lets provider-side prefix caching reuse it, and the
+template is compiled once instead of being rebuilt with f-strings per call.
+Each render counts the tokens of both segments with a local tokenizer and
+records them in /metrics.
+
+Bump a template's version whenever its wording changes; the version is part
+of the extraction and story cache keys. PROMPT_VERSION_OVERRIDES pins an older
+registered version, e.g. PROMPT_VERSION_OVERRIDES='{"story": 1}'.
+
+Sizes of every registered prompt, and what changed between versions:
+
+    python prompts.py             # token counts per segment and version
+    python prompts.py --diff      # plus a unified diff between consecutive versions
+    python prompts.py story       # only some prompts
+"""
+import os
+import re
+import json
+import difflib
+import argparse
+
+import metrics
+from context import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # Optional: token counts fall back to the ~4 characters per token estimate
+    tiktoken = None
+
+# tiktoken encoding used to count tokens (no Groq model tokenizer ships with it; this is a close proxy)
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "cl100k_base")
+PROMPT_VERSION_OVERRIDES = json.loads(os.getenv("PROMPT_VERSION_OVERRIDES") or "{}")
+
+# -------------------- Token Counting --------------------
+
+encoding = None
+
+def load_encoding():
+    """Loads the tiktoken encoding, which may download its BPE file; count_tokens estimates until this has run.
+
+    The API server calls it from a thread at startup, so a download never blocks the event loop.
+    """
+    global encoding, tiktoken
+    if encoding is None and tiktoken is not None:
+        try:
+            encoding = tiktoken.get_encoding(PROMPT_TOKENIZER)
+        except Exception:  # e.g. the encoding file can't be downloaded
+            tiktoken = None
+    return encoding
+
+def count_tokens(text):
+    """Tokens in text by the local tokenizer once it's loaded, else the ~4 characters per token estimate."""
+    if not text:
+        return 0
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+def tokenizer_name():
+    return f"tiktoken/{PROMPT_TOKENIZER}" if encoding is not None else "estimate (~4 chars/token)"
+
+# -------------------- Templates --------------------
+
+# Only bare {name} fields are placeholders, so JSON examples and schemas need no escaping
+FIELD_PATTERN = re.compile(r"\{(\w+)\}")
+
+class RenderedPrompt:
+    """Chat messages for one call, with the locally counted tokens of each segment."""
+
+    def __init__(self, template, messages, tokens):
+        self.name = template.name
+        self.version = template.version
+        self.messages = messages
+        self.tokens = tokens  # segment -> tokens
+
+class PromptTemplate:
+    """One version of a prompt: a static system segment and a user segment with {field} placeholders."""
+
+    def __init__(self, name, version, user, system="", sample=None):
+        self.name = name
+        self.version = version
+        self.system = system
+        self.user = user
+        self.sample = sample or {}  # field values used by `python prompts.py`
+        # Alternating literal text and field names, so rendering is one join
+        self.parts = FIELD_PATTERN.split(user)
+        self.fields = set(self.parts[1::2])
+        self.system_tokens = None
+        self.counted_with = None  # the encoding system_tokens was counted with (None: the estimate)
+
+    def render(self, **values):
+        """Fills in the user segment; the system segment (and its token count) never changes."""
+        parts = list(self.parts)
+        for index in range(1, len(parts), 2):
+            parts[index] = str(values[parts[index]])
+        user = "".join(parts)
+
+        if self.system_tokens is None or self.counted_with is not encoding:
+            self.system_tokens = count_tokens(self.system)
+            self.counted_with = encoding
+        tokens = {"system": self.system_tokens, "user": count_tokens(user)}
+
+        messages = [{"role": "user", "content": user}]
+        if self.system:
+            messages.insert(0, {"role": "system", "content": self.system})
+        return RenderedPrompt(self, messages, tokens)
+
+# -------------------- Registry --------------------
+
+templates = {}  # name -> {version: PromptTemplate}
+
+def register(template):
+    versions = templates.setdefault(template.name, {})
+    if template.version in versions:
+        raise ValueError(f"Prompt {template.name!r} v{template.version} is already registered")
+    versions[template.version] = template
+    return template
+
+def get(name):
+    """The template in use for name: the pinned version if one is configured, else the newest."""
+    versions = templates[name]
+    pinned = PROMPT_VERSION_OVERRIDES.get(name)
+    return versions[pinned] if pinned in versions else versions[max(versions)]
+
+def render(name, **values):
+    """Renders the template in use for name and records its segment sizes."""
+    prompt = get(name).render(**values)
+    for segment, tokens in prompt.tokens.items():
+        metrics.PROMPT_SEGMENT_TOKENS.observe(tokens, prompt=name, version=str(prompt.version), segment=segment)
+    return prompt
+
+# -------------------- Report --------------------
+
+def load_templates():
+    """Imports the modules that register templates."""
+    import extractData  # noqa: F401
+    import storygen  # noqa: F401
+
+def segment_sizes(template):
+    """Tokens of the system segment, the user segment's static text, and a sample render."""
+    static_user = "".join(template.parts[0::2])
+    sample = template.render(**{field: template.sample.get(field, "") for field in template.fields})
+    return {"system": count_tokens(template.system), "user_static": count_tokens(static_user),
+            "sample_user": sample.tokens["user"], "sample_total": sum(sample.tokens.values())}
+
+def describe(template):
+    sizes = segment_sizes(template)
+    in_use = " (in use)" if get(template.name) is template else ""
+    cacheable = sizes["system"] / sizes["sample_total"] if sizes["sample_total"] else 0
+    return (f"  v{template.version}{in_use}: system {sizes['system']}, user template {sizes['user_static']} "
+            f"→ sample call {sizes['sample_total']} tokens ({sizes['sample_user']} user, {cacheable:.0%} static prefix)")
+
+def compare(old, new):
+    before, after = segment_sizes(old), segment_sizes(new)
+    changes = ", ".join(f"{key} {after[key] - before[key]:+d}" for key in ("system", "user_static", "sample_total"))
+    return f"  v{old.version} → v{new.version}: {changes}"
+
+def diff(old, new):
+    def lines(template):
+        return (f"[system]\n{template.system}\n[user]\n{template.user}\n").splitlines(keepends=True)
+    return "".join(difflib.unified_diff(lines(old), lines(new), f"{old.name} v{old.version}", f"{new.name} v{new.version}"))
+
+def report(names=None, show_diff=False):
+    load_templates()
+    load_encoding()
+    print(f"🔢 Token counts by {tokenizer_name()}")
+    for name in names or sorted(templates):
+        versions = [templates[name][version] for version in sorted(templates[name])]
+        print(f"\n📝 {name}")
+        for template in versions:
+            print(describe(template))
+        for old, new in zip(versions, versions[1:]):
+            print(compare(old, new))
+            if show_diff:
+                print(diff(old, new))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", help="prompts to report (default: all)")
+    parser.add_argument("--diff", action="store_true", help="show the text changes between consecutive versions")
+    args = parser.parse_args()
+
+    # Templates register with the imported module, not with this script's __main__ copy of it
+    import prompts
+    prompts.report(args.names, args.diff)
+
+if __name__ == "__main__":
+    main()
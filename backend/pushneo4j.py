@@ -1,13 +1,29 @@
-from dbconnect import driver  # Use established Neo4j connection
+import os
+import json
+import time
+import hashlib
+import asyncio
+import logging
+import metrics
+from resources import resources  # Lazily-created, shared Neo4j drivers
+from mood import TONE_WRITE_QUERY, mood_kind, mood_increment, tone_rows
+from resolve import resolver, normalize, node_key
+from cache import normalize_text
 from extractData import extract_relationships_and_emotions
 from extractData import extract_people
 
+logger = logging.getLogger(__name__)
+
+# Triples per write while relationships are still streaming in from the LLM
+STREAM_WRITE_BATCH_SIZE = int(os.getenv("STREAM_WRITE_BATCH_SIZE", "8"))
+# Answers remembered per relation; a resubmit older than that counts as a new mention
+RELATION_ANSWER_KEYS = int(os.getenv("RELATION_ANSWER_KEYS", "50"))
+
 # -------------------- Helper Functions --------------------
 
-def is_person(name):
-    """Determines if the given entity is a person."""
-    person_names = {}  # Expand dynamically if needed
-    return name in person_names
+def is_person(name, person_keys):
+    """Determines if the given entity is one of the persons (person_keys holds their normalized names)."""
+    return normalize(name) in person_keys
 
 def is_bidirectional(relation):
     """Checks if a relationship should be bidirectional."""
@@ -17,84 +33,274 @@ def is_description_relation(relation):
     """Checks if a relationship is a description or explanation of an entity."""
     return relation in {"Why", "Description", "Reason"}
 
-# -------------------- Neo4j Storage Functions --------------------
+# -------------------- Neo4j Write Batches --------------------
+# Rows are grouped by (source label, relation, target label) so each group is
+# written with a single parameterized UNWIND statement instead of one
+# round-trip per row.
+
+def relationship_query(source_label, relation, target_label, create=False):
+    """Builds the UNWIND statement that writes one group of relationship rows.
 
-def store_person_to_person(session, source, relation, target):
-    """Handles Person-to-Person relationships (e.g., Sibling, Friend, Colleague)."""
-    query = """
-    MERGE (a:Person {name: $source})
-    MERGE (b:Person {name: $target})
-    MERGE (a)-[:`"""+relation+"""`]->(b)
+    Each relation counts the distinct answers that stated it (r.mentions) and
+    when it was first and last stated; rows from an answer it already holds
+    (a double-submit or a retried write) leave it unchanged. Mood relations of
+    a Person add each new mention to the user's mood summary as well.
     """
-    session.run(query, source=source, target=target)
-
-    # If the relation is bidirectional, store reverse relation
-    if is_bidirectional(relation):
-        reverse_query = """
-        MERGE (a:Person {name: $target})
-        MERGE (b:Person {name: $source})
-        MERGE (b)-[:`"""+relation+"""`]->(a)
-        """
-        session.run(reverse_query, source=target, target=source)
-
-def store_person_to_entity(session, source, relation, target):
-    """Handles Person-to-Entity relationships (e.g., Lives In, Works At, Likes)."""
-    query = """
-    MERGE (a:Person {name: $source})
-    MERGE (b:Entity {name: $target})
-    MERGE (a)-[:`"""+relation+"""`]->(b)
+    mood = mood_increment(relation) if source_label == "Person" else ""
+    relation = relation.replace("`", "``")
+    if create:
+        write = f"CREATE (a)-[r:`{relation}` {{user_id: $user_id}}]->(b) SET r.mentions = 0, r.answers = []"
+    else:
+        write = f"MERGE (a)-[r:`{relation}` {{user_id: $user_id}}]->(b) ON CREATE SET r.mentions = 0, r.answers = []"
+    return f"""
+    UNWIND $rows AS row
+    MERGE (a:{source_label} {{user_id: $user_id, key: row.source_key}}) ON CREATE SET a.name = row.source
+    MERGE (b:{target_label} {{user_id: $user_id, key: row.target_key}}) ON CREATE SET b.name = row.target
+    {write}
+    WITH b, r, row WHERE NOT row.answer IN coalesce(r.answers, [])
+    SET r.mentions = coalesce(r.mentions, 1) + 1,
+        r.first_seen = coalesce(r.first_seen, timestamp()),
+        r.last_seen = timestamp(),
+        r.answers = (coalesce(r.answers, []) + row.answer)[-{RELATION_ANSWER_KEYS}..]
+    {mood}"""
+
+def relationship_row(source, target, answer):
+    return {"source": source, "source_key": node_key(source), "target": target, "target_key": node_key(target), "answer": answer}
+
+def answer_key(answer, persons_list, relationships):
+    """Identifies the answer a write comes from; without its text, the written data stands in for it."""
+    if answer is None:
+        answer = json.dumps([persons_list, relationships], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(normalize_text(answer).encode("utf-8")).hexdigest()[:16]
+
+# Every write bumps the user's graph version in the same transaction, so
+# anything derived from the graph (e.g. the story cache) can tell it's stale
+GRAPH_VERSION_QUERY = """
+MERGE (g:UserGraph {user_id: $user_id})
+SET g.version = coalesce(g.version, 0) + 1
+"""
+
+def person_batches(persons_list):
+    """The batch that stores all identified persons."""
+    if not persons_list:
+        return []
+    return [("UNWIND $rows AS row MERGE (p:Person {user_id: $user_id, key: row.key}) ON CREATE SET p.name = row.name",
+             [{"name": person, "key": node_key(person)} for person in persons_list])]
+
+def relationship_batches(persons_list, relationships, answer=None):
+    """Groups relationships by label pairing and relation type; returns (batches, mood mentions in order)."""
+    batches = []
+    groups = {}
+    entity_descriptions = {}
+    person_keys = {normalize(person) for person in persons_list}
+    key = answer_key(answer, persons_list, relationships)
+    moods = []  # (kind, target key) of the Person mood relations, in order
+
+    for rel in relationships:
+        source = rel["source"]
+        relation = rel["relation"]
+        target = rel["target"]
+
+        # If this is a description about an entity, store it separately
+        source_is_person = is_person(source, person_keys)
+        target_is_person = is_person(target, person_keys)
+
+        # If this is a description about an entity, store it separately
+        if not target_is_person and is_description_relation(relation):
+            entity_descriptions[target] = {"relation": relation, "description": source}
+            continue  # Skip normal processing for now
+
+        if source_is_person and mood_kind(relation):
+            moods.append((mood_kind(relation), node_key(target)))
+
+        if source_is_person and target_is_person:
+            # Person-to-Person relationships (e.g., Sibling, Friend, Colleague)
+            rows = groups.setdefault(("Person", relation, "Person", False), [])
+            rows.append(relationship_row(source, target, key))
+            # If the relation is bidirectional, store reverse relation
+            if is_bidirectional(relation):
+                rows.append(relationship_row(target, source, key))
+        elif source_is_person:
+            # Person-to-Entity relationships (e.g., Lives In, Works At, Likes)
+            groups.setdefault(("Person", relation, "Entity", False), []).append(relationship_row(source, target, key))
+        else:
+            # Entity-to-Entity relationships (e.g., Located In, Why, Category)
+            groups.setdefault(("Entity", relation, "Entity", False), []).append(relationship_row(source, target, key))
+
+    # 🔵 Descriptions are attached to the correct entities
+    for entity, details in entity_descriptions.items():
+        groups.setdefault(("Entity", details["relation"], "Entity", True), []).append(
+            relationship_row(details["description"], entity, key))
+
+    for (source_label, relation, target_label, create), rows in groups.items():
+        batches.append((relationship_query(source_label, relation, target_label, create), rows))
+
+    return batches, moods
+
+def trailing_batches(moods):
+    """The batches that close an answer's write, after every relation group."""
+    # 💭 The relation statements counted the new moods; point the latest tone at this answer's
+    batches = []
+    rows = tone_rows(moods)
+    if rows:
+        batches.append((TONE_WRITE_QUERY, rows))
+
+    # 🔢 Finally, bump the graph version (once per transaction, even when batches are merged)
+    batches.append((GRAPH_VERSION_QUERY, []))
+    return batches
+
+def build_write_batches(persons_list, relationships, answer=None):
+    """Groups the extracted data into (query, rows) batches, persons first."""
+    # 🟢 First, store all identified persons
+    batches = person_batches(persons_list)
+
+    # 🟡 Then, group relationships by label pairing and relation type
+    groups, moods = relationship_batches(persons_list, relationships, answer)
+    batches += groups
+
+    if batches:
+        batches += trailing_batches(moods)
+    return batches
+
+def write_batches(tx, batches, user_id):
+    """Transaction function that runs every batch for one user inside one write transaction."""
+    for query, rows in batches:
+        started = time.perf_counter()
+        tx.run(query, rows=rows, user_id=user_id).consume()
+        metrics.observe_query("write", len(rows), started)
+
+async def write_batches_async(tx, batches, user_id):
+    """Async transaction function counterpart of write_batches."""
+    for query, rows in batches:
+        started = time.perf_counter()
+        result = await tx.run(query, rows=rows, user_id=user_id)
+        await result.consume()
+        metrics.observe_query("write", len(rows), started)
+
+# The latest tone reads the mood items the relation groups updated, so it's written after all of them
+TRAILING_QUERIES = (TONE_WRITE_QUERY, GRAPH_VERSION_QUERY)
+
+def merge_write_batches(items):
+    """Combines the batches of several answers so rows sharing a statement and user go out together."""
+    merged = {}
+    for persons_list, relationships, user_id, _, answer in items:
+        for query, rows in build_write_batches(persons_list, relationships, answer):
+            merged.setdefault((query, user_id), []).extend(rows)
+    order = sorted(merged, key=lambda key: TRAILING_QUERIES.index(key[0]) + 1 if key[0] in TRAILING_QUERIES else 0)
+    return [(query, merged[(query, user_id)], user_id) for query, user_id in order]
+
+async def write_merged_batches_async(tx, merged):
+    """Async transaction function for batches spanning several users."""
+    for query, rows, user_id in merged:
+        started = time.perf_counter()
+        result = await tx.run(query, rows=rows, user_id=user_id)
+        await result.consume()
+        metrics.observe_query("bulk_write", len(rows), started)
+
+# -------------------- Main Storage Functions --------------------
+
+def store_in_neo4j(persons_list, relationships, user_id, user_name=None, answer=None):
+    """Stores extracted relationships in the user's subgraph in a single managed transaction (retried on transient errors).
+
+    Names and relation labels are resolved against the user's existing nodes
+    first; returns the (persons, relationships) that were actually written.
+    answer is the text they were extracted from, so storing it again doesn't
+    count its relations twice.
+    """
+    persons_list, relationships = resolver.resolve(user_id, persons_list, relationships, user_name)
+    batches = build_write_batches(persons_list, relationships, answer)
+    with resources.driver.session() as session:
+        session.execute_write(write_batches, batches, user_id)
+    resolver.written(user_id)
+
+    logger.debug("✅ Data successfully stored in Neo4j!")
+    return persons_list, relationships
+
+async def write_async(user_id, batches):
+    """Runs batches for one user in their own managed transaction."""
+    async with resources.async_driver.session() as session:
+        await session.execute_write(write_batches_async, batches, user_id)
+
+async def store_in_neo4j_async(persons_list, relationships, user_id, user_name=None, answer=None):
+    """Async variant of store_in_neo4j that runs on the async driver."""
+    persons_list, relationships = await resolver.resolve_async(user_id, persons_list, relationships, user_name)
+    await write_async(user_id, build_write_batches(persons_list, relationships, answer))
+    resolver.written(user_id)
+
+    logger.debug("✅ Data successfully stored in Neo4j!")
+    return persons_list, relationships
+
+async def store_many_in_neo4j_async(items):
+    """Stores many (persons, relationships, user_id, user_name, answer) answers in a single managed transaction.
+
+    Returns the items as they were written, with their names and relation labels resolved.
     """
-    session.run(query, source=source, target=target)
-
-def store_entity_to_entity(session, source, relation, target):
-    """Handles Entity-to-Entity relationships (e.g., Located In, Why, Category)."""
-    query = """
-    MERGE (a:Entity {name: $source})
-    MERGE (b:Entity {name: $target})
-    MERGE (a)-[:`"""+relation+"""`]->(b)
+    items = [(*await resolver.resolve_async(user_id, persons_list, relationships, user_name), user_id, user_name, answer)
+             for persons_list, relationships, user_id, user_name, answer in items]
+    merged = merge_write_batches(items)
+    async with resources.async_driver.session() as session:
+        await session.execute_write(write_merged_batches_async, merged)
+    for user_id in {item[2] for item in items}:
+        resolver.written(user_id)
+    return items
+
+async def store_stream_in_neo4j_async(persons_list, triple_stream, user_id, user_name=None, batch_size=STREAM_WRITE_BATCH_SIZE,
+                                      answer=None):
+    """Writes relationships in micro-batches while triple_stream is still producing them.
+
+    Writes go through a single writer task, one after another, so they never race
+    each other on the same nodes, but they overlap with token generation. The
+    persons go out with the first micro-batch, and the latest tone and graph
+    version are written once, after the last one (or after the stream failed,
+    for whatever was written), so one answer moves the version once.
+    Returns every (resolved) relationship that was written. If a write fails, the
+    stream is closed right away (no more tokens are generated for nothing) and the
+    write's error is raised.
     """
-    session.run(query, source=source, target=target)
-
-# -------------------- Main Storage Function --------------------
-
-def store_in_neo4j(persons_list, relationships):
-    """Stores extracted relationships in Neo4j, ensuring persons are stored first."""
-    with driver.session() as session:
-        # 🟢 First, store all identified persons
-        for person in persons_list:
-            query = "MERGE (p:Person {name: $name})"
-            session.run(query, name=person)
-
-        # 🟡 Then, process relationships
-        entity_descriptions = {}
-
-        for rel in relationships:
-            source = rel["source"]
-            relation = rel["relation"]
-            target = rel["target"]
-
-            # If this is a description about an entity, store it separately
-            if target not in persons_list and is_description_relation(relation):
-                entity_descriptions[target] = {"relation": relation, "description": source}
-                continue  # Skip normal processing for now
-
-            if source in persons_list and target in persons_list:
-                store_person_to_person(session, source, relation, target)
-            elif source in persons_list and target not in persons_list:
-                store_person_to_entity(session, source, relation, target)
-            else:
-                store_entity_to_entity(session, source, relation, target)
-
-        # 🔵 Process descriptions and attach them to the correct entities
-        for entity, details in entity_descriptions.items():
-            query = """
-            MERGE (b:Entity {name: $entity})
-            MERGE (d:Entity {name: $desc})
-            CREATE (d)-[:`"""+details["relation"]+"""`]->(b)
-            """
-            session.run(query, entity=entity, desc=details["description"])
-
-    print("✅ Data successfully stored in Neo4j!")
+    relationships = []
+    moods = []
+    queue = asyncio.Queue()
+
+    async def writer():
+        first = True
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            resolved_persons, batch = await resolver.resolve_async(user_id, persons_list, batch, user_name)
+            batches, batch_moods = relationship_batches(resolved_persons, batch, answer)
+            if first:
+                batches = person_batches(resolved_persons) + batches
+            await write_async(user_id, batches)
+            first = False
+            relationships.extend(batch)
+            moods.extend(batch_moods)
+
+    writer_task = asyncio.create_task(writer())
+    pending = []
+    try:
+        async for triples in triple_stream:
+            if writer_task.done():
+                break  # the writer failed; awaiting it below raises its error
+            pending.extend(triples)
+            if len(pending) >= batch_size:
+                queue.put_nowait(pending)
+                pending = []
+        if pending and not writer_task.done():
+            queue.put_nowait(pending)
+        queue.put_nowait(None)
+        await writer_task
+    finally:
+        writer_task.cancel()
+        try:
+            await triple_stream.aclose()
+        finally:
+            if relationships:
+                await write_async(user_id, trailing_batches(moods))
+                resolver.written(user_id)
+
+    logger.debug("✅ Data successfully stored in Neo4j!")
+    return relationships
 
 # -------------------- Execution Example --------------------
 
@@ -109,4 +315,4 @@ if __name__ == "__main__":
     persons_list = extract_people(text)
     relationships = extracted_data["relationships"] if "relationships" in extracted_data else []
 
-    store_in_neo4j(persons_list, relationships)
+    store_in_neo4j(persons_list, relationships, user_id="example")
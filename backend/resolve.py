@@ -0,0 +1,275 @@
+import os
+import re
+import difflib
+import unicodedata
+from collections import OrderedDict
+
+from resources import resources  # Lazily-created, shared Neo4j drivers
+from context import dedupe_facts
+from fetchfromdb import fetch_graph_version, fetch_graph_version_async
+
+# -------------------- Entity Resolution --------------------
+# Runs between extraction and storage. The LLM names the same thing many ways
+# ("Rakshit", "rakshit", "Rakshit (brother)", "my little brother"), and MERGE on
+# the raw string would turn each spelling into its own node. Every user gets an
+# alias index that maps normalized spellings, pronouns and family/role words to
+# the name first stored for that node; relation labels go through a synonym
+# table. Lookups are dictionary hits, with a fuzzy fallback only over
+# candidates that share a first letter and a similar length; every answer it
+# finds is cached as a new alias. Nodes are merged on their normalized name
+# (the `key` property), so spellings a worker's index hasn't seen yet still
+# end up on one node.
+
+# Fuzzy matches must be at least this similar (difflib ratio, 0..1)
+FUZZY_THRESHOLD = float(os.getenv("RESOLVE_FUZZY_THRESHOLD", "0.88"))
+# Users whose alias index is kept in memory
+RESOLVER_MAX_USERS = int(os.getenv("RESOLVER_MAX_USERS", "10000"))
+
+FIRST_PERSON = {"i", "me", "myself", "my", "mine", "user", "the user"}
+# Only resolved as the subject of a triple, and only when the answer names one other person
+THIRD_PERSON = {"he", "she", "they"}
+
+# Words dropped in front of a role ("my little brother" -> "brother")
+ROLE_MODIFIERS = {"my", "our", "his", "her", "their", "the", "a", "an", "little", "younger", "older",
+                  "elder", "big", "baby", "kid", "dear", "beloved", "best"}
+
+# Relation labels that also name the role of the target ("Tanvi → (Brother) → Rakshit")
+ROLE_RELATIONS = {"brother", "sister", "sibling", "mother", "mom", "mum", "father", "dad", "parent",
+                  "son", "daughter", "cousin", "uncle", "aunt", "grandmother", "grandma", "grandfather",
+                  "grandpa", "wife", "husband", "partner", "boyfriend", "girlfriend", "friend",
+                  "best friend", "roommate", "teacher", "mentor", "boss", "manager", "colleague"}
+
+# Casefolded label -> canonical label. Labels not listed keep their own wording.
+RELATION_SYNONYMS = {
+    "sibling": "Sibling", "siblings": "Sibling", "brother": "Sibling", "sister": "Sibling",
+    "brother of": "Sibling", "sister of": "Sibling", "sibling of": "Sibling",
+    "friend": "Friend", "friends": "Friend", "friend of": "Friend", "best friend": "Friend",
+    "married": "Married", "married to": "Married", "spouse": "Married", "wife": "Married", "husband": "Married",
+    "colleague": "Colleague", "colleagues": "Colleague", "coworker": "Colleague", "co-worker": "Colleague",
+    "feeling": "Feeling", "feelings": "Feeling", "feels": "Feeling", "emotion": "Feeling", "emotions": "Feeling",
+    "current feeling": "Feeling", "emotional state": "Feeling",
+    "state of mind": "State of Mind", "mental state": "State of Mind", "mood": "State of Mind",
+    "concern": "Concern", "concerns": "Concern", "worry": "Concern", "worried about": "Concern",
+    "worries": "Concern", "anxious about": "Concern",
+    "tone": "Tone", "tone of the text": "Tone", "tone of text": "Tone",
+    "lives in": "Lives in", "resides in": "Lives in", "living in": "Lives in", "residence": "Lives in",
+    "hobby": "Hobby", "hobbies": "Hobby", "enjoys": "Hobby", "likes to": "Hobby",
+    "age": "Age", "is aged": "Age",
+}
+
+def clean_name(name):
+    """Display form: NFKC, trimmed, inner whitespace collapsed, trailing "(...)" removed."""
+    name = " ".join(unicodedata.normalize("NFKC", str(name)).split())
+    return re.sub(r"\s*\([^)]*\)\s*$", "", name).strip(" .,'\"") or name
+
+def normalize(name):
+    """Lookup key: clean_name, casefolded, possessive "'s" and punctuation dropped."""
+    key = clean_name(name).casefold().replace("’", "'")
+    key = re.sub(r"'s\b", "", key)
+    return " ".join(re.sub(r"[^\w\s-]", " ", key).split())
+
+def node_key(name):
+    """The key property nodes are merged on: normalize(name), or the name itself if that leaves nothing."""
+    return normalize(name) or str(name)
+
+def role_key(name):
+    """The bare role word of a phrase like "my little brother", or None if it isn't one."""
+    words = [word for word in normalize(name).split() if word not in ROLE_MODIFIERS]
+    role = " ".join(words)
+    if role in ROLE_RELATIONS:
+        return role
+    # "Rakshit (brother)" carries its role in the parentheses
+    match = re.search(r"\(([^)]*)\)\s*$", str(name))
+    return role_key(match.group(1)) if match else None
+
+def canonical_relation(relation):
+    label = " ".join(str(relation).split())
+    return RELATION_SYNONYMS.get(label.casefold(), label)
+
+class AliasIndex:
+    """Normalized aliases of one user's nodes."""
+
+    def __init__(self):
+        self.aliases = {}     # normalized alias -> canonical name
+        self.persons = {}     # canonical names of Person nodes -> their normalized words
+        self.buckets = {}     # (first char, length) -> normalized canonical keys, for fuzzy lookups
+        self.roles = {}       # role word -> canonical person name
+        self.user = None      # the user's own canonical name
+        self.loaded = False
+        self.version = 0      # the user's graph version the index has seen every name of
+
+    def add(self, name, person=False):
+        """Registers a canonical name (if new) and returns the canonical name it resolves to."""
+        existing = self.lookup(name, person)
+        if existing is not None:
+            if person:
+                self.persons.setdefault(existing, set(normalize(existing).split()))
+            return existing
+        canonical = clean_name(name)
+        key = normalize(canonical)
+        self.aliases[key] = canonical
+        self.buckets.setdefault((key[:1], len(key)), []).append(key)
+        if person:
+            self.persons[canonical] = set(key.split())
+        return canonical
+
+    def lookup(self, name, person=False):
+        """The canonical name for name, or None if it doesn't match any known node."""
+        key = normalize(name)
+        if not key:
+            return None
+        if key in self.aliases:
+            return self.aliases[key]
+
+        found = None
+        if key in FIRST_PERSON:
+            found = self.user
+        else:
+            role = role_key(name)
+            if role is not None:
+                found = self.roles.get(role)
+            if found is None and person:
+                found = self.token_match(key)
+            if found is None:
+                found = self.fuzzy_match(key, person)
+
+        if found is not None:
+            self.aliases[key] = found  # next time it's a dictionary hit
+        return found
+
+    def token_match(self, key):
+        """A person whose name starts with the same given name and shares all the query's words ("Rakshit" ~ "Rakshit Sharma")."""
+        tokens = set(key.split())
+        first = key.split()[0]
+        for person, person_tokens in self.persons.items():
+            if first in person_tokens and normalize(person).startswith(first) and (tokens <= person_tokens or person_tokens <= tokens):
+                return person
+        return None
+
+    def fuzzy_match(self, key, person=False):
+        """Closest spelling among names of the same kind with the same first letter and a length within two ("Rakshith" ~ "Rakshit")."""
+        # Short names and anything with digits (dates, ages) are too easy to confuse
+        if len(key) < 5 or any(char.isdigit() for char in key):
+            return None
+        best, best_ratio = None, FUZZY_THRESHOLD
+        for length in range(len(key) - 2, len(key) + 3):
+            for candidate in self.buckets.get((key[:1], length), ()):
+                if (self.aliases[candidate] in self.persons) != person:
+                    continue
+                matcher = difflib.SequenceMatcher(None, key, candidate)
+                if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                    continue
+                ratio = matcher.ratio()
+                if ratio >= best_ratio:
+                    best, best_ratio = candidate, ratio
+        return self.aliases[best] if best is not None else None
+
+    def resolve(self, persons_list, relationships, user_name=None):
+        """Returns (persons, relationships) rewritten to canonical names and relation labels."""
+        if user_name:
+            self.user = self.add(user_name, person=True)
+
+        persons = []
+        for person in persons_list:
+            canonical = self.add(person, person=True)
+            if canonical not in persons:
+                persons.append(canonical)
+
+        # "He"/"She" can only be resolved when the answer mentions exactly one other person
+        others = [person for person in persons if person != self.user]
+        third_person = others[0] if len(others) == 1 else None
+
+        # Learn the user's role words first, so "my brother" elsewhere in the answer already resolves
+        for rel in relationships:
+            source = self.lookup(rel["source"], person=True)
+            target = self.lookup(rel["target"], person=True)
+            if target not in self.persons or (self.user is not None and source != self.user):
+                continue
+            role = role_key(rel["relation"])
+            if role is not None:
+                self.roles.setdefault(role, target)
+            if "(" in str(rel["target"]):
+                named_role = role_key(rel["target"])
+                if named_role is not None:
+                    self.roles.setdefault(named_role, target)
+
+        resolved = []
+        for rel in relationships:
+            if normalize(rel["source"]) in THIRD_PERSON and third_person is not None:
+                source = third_person
+            else:
+                source = self.add(rel["source"], rel["source"] in persons_list)
+            target = self.add(rel["target"], rel["target"] in persons_list)
+            if source in self.persons and source not in persons:
+                persons.append(source)
+            if target in self.persons and target not in persons:
+                persons.append(target)
+            resolved.append({"source": source, "relation": canonical_relation(rel["relation"]), "target": target})
+
+        return persons, dedupe_facts(resolved)
+
+# -------------------- Per-user Indexes --------------------
+# Indexes are seeded from the names already stored for the user, so a fresh
+# worker resolves against the same canonical names as the one that wrote them.
+# They are seeded again whenever the user's graph version has moved past the
+# one they were built from, i.e. another worker has written in the meantime.
+
+NAMES_QUERY = """
+MATCH (p:Person {user_id: $user_id}) RETURN p.name AS name, true AS person
+UNION ALL
+MATCH (e:Entity {user_id: $user_id}) RETURN e.name AS name, false AS person
+"""
+
+class Resolver:
+    """LRU of per-user alias indexes."""
+
+    def __init__(self, max_users=RESOLVER_MAX_USERS):
+        self.max_users = max_users
+        self.indexes = OrderedDict()
+
+    def index(self, user_id):
+        index = self.indexes.get(user_id)
+        if index is None:
+            index = self.indexes[user_id] = AliasIndex()
+            while len(self.indexes) > self.max_users:
+                self.indexes.popitem(last=False)
+        self.indexes.move_to_end(user_id)
+        return index
+
+    def seed(self, index, records, version):
+        for record in records:
+            index.add(record["name"], person=record["person"])
+        index.loaded = True
+        index.version = version
+
+    def stale(self, index, version):
+        return not index.loaded or version > index.version
+
+    def resolve(self, user_id, persons_list, relationships, user_name=None):
+        """Canonicalizes one answer's extraction for user_id (sync driver, for scripts)."""
+        index = self.index(user_id)
+        version = fetch_graph_version(user_id)
+        if self.stale(index, version):
+            with resources.driver.session() as session:
+                self.seed(index, list(session.run(NAMES_QUERY, user_id=user_id)), version)
+        return index.resolve(persons_list, relationships, user_name)
+
+    async def resolve_async(self, user_id, persons_list, relationships, user_name=None):
+        """Async variant of resolve used by the API server."""
+        index = self.index(user_id)
+        version = await fetch_graph_version_async(user_id)
+        if self.stale(index, version):
+            async with resources.async_driver.session() as session:
+                result = await session.run(NAMES_QUERY, user_id=user_id)
+                records = [record async for record in result]
+            if self.stale(index, version):
+                self.seed(index, records, version)
+        return index.resolve(persons_list, relationships, user_name)
+
+    def written(self, user_id):
+        """Counts a graph version bump made by this worker, so it isn't mistaken for another worker's write."""
+        index = self.indexes.get(user_id)
+        if index is not None and index.loaded:
+            index.version += 1
+
+resolver = Resolver()
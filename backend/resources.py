@@ -0,0 +1,123 @@
+import os
+import httpx
+from dotenv import load_dotenv
+from groq import Groq, AsyncGroq
+from neo4j import GraphDatabase, AsyncGraphDatabase
+
+# Load environment variables from .env file (the only place this happens;
+# every other module imports this one before reading its own settings)
+load_dotenv()
+
+# -------------------- Shared Clients --------------------
+# One pooled Neo4j driver and one keep-alive LLM HTTP client per process,
+# created on first use so importing a module never touches the network.
+# The FastAPI lifespan in main.py closes them on shutdown. The Groq clients
+# don't retry on their own; llm.dispatcher owns retries and rate limiting.
+
+class Settings:
+    """Connection settings, read from the environment."""
+
+    def __init__(self):
+        self.neo4j_uri = os.getenv("URI")
+        self.neo4j_user = os.getenv("USERNAME")
+        self.neo4j_password = os.getenv("PASSWORD")
+        self.neo4j_max_pool_size = int(os.getenv("NEO4J_MAX_POOL_SIZE", "100"))
+        self.neo4j_connection_timeout = float(os.getenv("NEO4J_CONNECTION_TIMEOUT", "5"))
+        self.neo4j_acquisition_timeout = float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "30"))
+        self.neo4j_max_connection_lifetime = float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600"))
+        # How long (seconds) managed write transactions keep retrying on transient errors
+        self.neo4j_max_transaction_retry_time = float(os.getenv("NEO4J_MAX_TRANSACTION_RETRY_TIME", "15"))
+
+        self.groq_api_key = os.getenv("GROQ_API_KEY")
+        self.llm_max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+        self.llm_max_keepalive = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+        self.llm_keepalive_expiry = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+        self.llm_connect_timeout = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+        self.llm_timeout = float(os.getenv("LLM_TIMEOUT", "120"))
+
+    def neo4j_config(self):
+        return {
+            "auth": (self.neo4j_user, self.neo4j_password),
+            "max_connection_pool_size": self.neo4j_max_pool_size,
+            "connection_timeout": self.neo4j_connection_timeout,
+            "connection_acquisition_timeout": self.neo4j_acquisition_timeout,
+            "max_connection_lifetime": self.neo4j_max_connection_lifetime,
+            "max_transaction_retry_time": self.neo4j_max_transaction_retry_time,
+        }
+
+    def http_limits(self):
+        return httpx.Limits(
+            max_connections=self.llm_max_connections,
+            max_keepalive_connections=self.llm_max_keepalive,
+            keepalive_expiry=self.llm_keepalive_expiry,
+        )
+
+    def http_timeout(self):
+        return httpx.Timeout(self.llm_timeout, connect=self.llm_connect_timeout)
+
+class Resources:
+    """Lazily-created, process-wide clients."""
+
+    def __init__(self):
+        self._settings = None
+        self._driver = None
+        self._async_driver = None
+        self._llm = None
+        self._async_llm = None
+
+    @property
+    def settings(self):
+        if self._settings is None:
+            self._settings = Settings()
+        return self._settings
+
+    @property
+    def driver(self):
+        """Sync Neo4j driver, for scripts and code running in worker threads."""
+        if self._driver is None:
+            self._driver = GraphDatabase.driver(self.settings.neo4j_uri, **self.settings.neo4j_config())
+        return self._driver
+
+    @property
+    def async_driver(self):
+        """Async Neo4j driver, for the API server's event loop."""
+        if self._async_driver is None:
+            self._async_driver = AsyncGraphDatabase.driver(self.settings.neo4j_uri, **self.settings.neo4j_config())
+        return self._async_driver
+
+    @property
+    def llm(self):
+        """Sync Groq client over a pooled keep-alive HTTP client."""
+        if self._llm is None:
+            http_client = httpx.Client(limits=self.settings.http_limits(), timeout=self.settings.http_timeout())
+            self._llm = Groq(api_key=self.settings.groq_api_key, http_client=http_client, max_retries=0)
+        return self._llm
+
+    @property
+    def async_llm(self):
+        """Async Groq client shared by every call site, so calls reuse warm TLS connections."""
+        if self._async_llm is None:
+            http_client = httpx.AsyncClient(limits=self.settings.http_limits(), timeout=self.settings.http_timeout())
+            self._async_llm = AsyncGroq(api_key=self.settings.groq_api_key, http_client=http_client, max_retries=0)
+        return self._async_llm
+
+    async def aclose(self):
+        """Closes whatever was created; safe to call more than once."""
+        if self._async_driver is not None:
+            await self._async_driver.close()
+            self._async_driver = None
+        if self._async_llm is not None:
+            await self._async_llm.close()
+            self._async_llm = None
+        self.close()
+
+    def close(self):
+        """Closes the sync clients."""
+        if self._driver is not None:
+            self._driver.close()
+            self._driver = None
+        if self._llm is not None:
+            self._llm.close()
+            self._llm = None
+
+resources = Resources()
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# -------------------- User Sessions --------------------
+# /store-user/ issues an opaque token and every later request sends it back
+# (X-Session-Token header, or ?session= where headers can't be set, e.g.
+# EventSource). Sessions expire SESSION_TTL seconds after they were last used.
+#
+# "memory" keeps sessions in this process only, which is fine for a single
+# uvicorn worker. "sqlite" keeps them in a file every worker on the machine
+# reads, so the API can run with --workers N (background job state goes to the
+# same file, see jobs.py).
+
+class SessionStore:
+    """Interface for session backends."""
+
+    def create(self, user):
+        """Stores user (a JSON-serializable dict) and returns a new token."""
+        raise NotImplementedError
+
+    def get(self, token):
+        """Returns the session's user and extends its TTL, or None if unknown or expired."""
+        raise NotImplementedError
+
+    def delete(self, token):
+        raise NotImplementedError
+
+def new_token():
+    return secrets.token_urlsafe(32)
+
+class MemorySessionStore(SessionStore):
+    """Per-process LRU of sessions with a sliding TTL."""
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sessions = OrderedDict()  # token -> (expires_at, user)
+        self.lock = threading.Lock()
+
+    def create(self, user):
+        token = new_token()
+        with self.lock:
+            self.sessions[token] = (time.time() + self.ttl, user)
+            while len(self.sessions) > self.max_entries:
+                self.sessions.popitem(last=False)
+        return token
+
+    def get(self, token):
+        with self.lock:
+            entry = self.sessions.get(token)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.sessions[token]
+                return None
+            self.sessions[token] = (time.time() + self.ttl, entry[1])
+            self.sessions.move_to_end(token)
+            return entry[1]
+
+    def delete(self, token):
+        with self.lock:
+            self.sessions.pop(token, None)
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite file shared by every worker process on the host."""
+
+    # Expired rows are swept on every Nth create rather than on every request
+    PURGE_EVERY = 100
+
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self.creates = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self.db.execute("PRAGMA journal_mode=WAL")  # readers in other workers don't block writers
+        self.db.execute("CREATE TABLE IF NOT EXISTS sessions (token TEXT PRIMARY KEY, user TEXT NOT NULL, expires_at REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+        self.db.commit()
+
+    def create(self, user):
+        token = new_token()
+        with self.lock:
+            self.db.execute("INSERT INTO sessions (token, user, expires_at) VALUES (?, ?, ?)",
+                            (token, json.dumps(user), time.time() + self.ttl))
+            self.creates += 1
+            if self.creates % self.PURGE_EVERY == 0:
+                self.db.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+            self.db.commit()
+        return token
+
+    def get(self, token):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT user FROM sessions WHERE token = ? AND expires_at >= ?", (token, now)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE sessions SET expires_at = ? WHERE token = ?", (now + self.ttl, token))
+            self.db.commit()
+        return json.loads(row[0])
+
+    def delete(self, token):
+        with self.lock:
+            self.db.execute("DELETE FROM sessions WHERE token = ?", (token,))
+            self.db.commit()
+
+def make_session_store():
+    """Builds the backend chosen by SESSION_BACKEND ("memory" or "sqlite")."""
+    ttl = float(os.getenv("SESSION_TTL", "86400"))
+    if os.getenv("SESSION_BACKEND", "memory") == "sqlite":
+        return SQLiteSessionStore(os.getenv("SESSION_DB_PATH", "sessions.sqlite3"), ttl)
+    return MemorySessionStore(ttl, int(os.getenv("SESSION_MAX_ENTRIES", "10000")))
@@ -1,69 +1,58 @@
 import os
-from fetchfromdb import fetch_all_data
-from groq import Groq
-from dotenv import load_dotenv
+import sys
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from llm import dispatcher, INTERACTIVE, BACKGROUND  # Rate-limited, retrying access to the shared Groq clients
+from fetchfromdb import fetch_all_data, fetch_all_data_async, fetch_graph_version_async
+from context import select_context
+from mood import fetch_mood_summary, fetch_mood_summary_async
+from cache import ExtractionCache
+import prompts
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-# Initialize Groq client with a different model
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# Story generation uses a different model from extraction
+STORY_MODEL = "deepseek-r1-distill-qwen-32b"
 
-def analyze_mood(persons):
-    """Determines the dominant emotions and concerns of the user."""
-    emotions = []
-    concerns = []
-    personal_details = []
+# Approximate tokens the user's facts may take up in the story prompt
+STORY_CONTEXT_TOKEN_BUDGET = int(os.getenv("STORY_CONTEXT_TOKEN_BUDGET", "1500"))
 
-    for person in persons:
-        if person["relation"] == "Feeling" or person["relation"] == "State of Mind":
-            emotions.append(person["target"])
-        elif person["relation"] == "Concern":
-            concerns.append(person["target"])
-        else:
-            personal_details.append(f"{person['source']} → ({person['relation']}) → {person['target']}")
+def build_story_prompt(user_id, user_name=None):
+    """Builds the story prompt from the user's stored data, or returns None if there is nothing to tell."""
+    return compose_story_prompt(fetch_all_data(user_id), user_name, fetch_mood_summary(user_id))
 
-    return emotions, concerns, personal_details
+async def build_story_prompt_async(user_id, user_name=None):
+    """Async variant of build_story_prompt used by the API server."""
+    data, mood = await asyncio.gather(fetch_all_data_async(user_id), fetch_mood_summary_async(user_id))
+    return compose_story_prompt(data, user_name, mood)
 
-def generate_uplifting_story():
-    """Generates a mood-lifting story based on user's emotions, concerns, and all extracted data."""
+# -------------------- Prompt --------------------
+# v1 is the original single-message layout (instructions after the data), kept
+# for PROMPT_VERSION_OVERRIDES and `python prompts.py --diff`; v2 sends the
+# instructions as a fixed system message and only the user's details after it.
 
-    data = fetch_all_data()
-    persons = data["Persons"]
-    entities = data["Entities"]
-
-    if not persons:
-        print("No persons found in the database to create a story.")
-        return
+SAMPLE_DETAILS = """📌 **User's Latest Tone:** Hopeful
 
-    # 🔎 Step 1: Analyze Mood & Data
-    emotions, concerns, personal_details = analyze_mood(persons)
+📌 **User's Current Emotions:**
+- Anxious
+- Hopeful
 
-    # 🟢 Step 2: Construct a Story Prompt with ALL Data
-    prompt = "Create an uplifting, motivational, and comforting short story for the user based on the following details:\n\n"
+📌 **User's Concerns:**
+- Upcoming exams
 
-    # 🟡 Include Extracted Emotions
-    if emotions:
-        prompt += "📌 **User's Current Emotions:**\n"
-        for emotion in emotions:
-            prompt += f"- {emotion}\n"
+📌 **Additional Details About User:**
+- Tanvi → (Sibling) → Rakshit
+- Tanvi → (Lives in) → Vadodara
+- Tanvi → (Hobby) → Playing Chess
+- Rakshit → (Hobby) → Piano
+"""
 
-    # 🔵 Include Extracted Concerns
-    if concerns:
-        prompt += "\n📌 **User's Concerns:**\n"
-        for concern in concerns:
-            prompt += f"- {concern}\n"
-
-    # 🔴 Include ALL Extracted Data (Persons + Entities)
-    prompt += "\n📌 **Additional Details About User:**\n"
-    for detail in personal_details:
-        prompt += f"- {detail}\n"
-    
-    for entity in entities:
-        prompt += f"- {entity['source']} → ({entity['relation']}) → {entity['target']}\n"
+prompts.register(prompts.PromptTemplate("story", 1, sample={"details": SAMPLE_DETAILS}, user="""Create an uplifting, motivational, and comforting short story for the user based on the following details:
 
-    # ✨ Positive Story Instructions
-    prompt += """
+{details}""" + """
     
 📖 **Instructions for the Story:**
 - The story should be **uplifting, inspiring, and emotionally reassuring**.
@@ -79,22 +68,357 @@ def generate_uplifting_story():
 Now, using the given emotions, concerns, and extracted data, **create a unique, comforting story.**
 
 JUST RETURN THE STORY, NO ELSE THINKING OR ANYTHING ONLY STORY.
-    """
+    """))
 
-    # 🔥 Step 3: Call Groq API (Different Model)
-    response = client.chat.completions.create(
-        messages=[{"role": "user", "content": prompt}],
-        model="deepseek-r1-distill-qwen-32b",
-        stream=False,
-    )
+prompts.register(prompts.PromptTemplate("story", 2, sample={"details": SAMPLE_DETAILS}, system="""Create an uplifting, motivational, and comforting short story for the user based on the details the user sends.
+
+📖 **Instructions for the Story:**
+- The story should be **uplifting, inspiring, and emotionally reassuring**.
+- Acknowledge the user's **current emotions** but **guide them towards hope, courage, and happiness**.
+- Use **gentle, warm, and encouraging storytelling**.
+- The story should be **positive and heartwarming**, leaving the user feeling **lighter, hopeful, and motivated**.
+- **Incorporate the user's details into the story** in a natural way.
+- **End with an inspiring message** about growth, love, and resilience.
+
+💡 **Example Start:**
+"Tanvi sat by the window, feeling a little lost. The day had been overwhelming, and emotions ran high. But as she looked at the sky, she noticed something—the way the sun always set, only to rise again. Just like that, she knew... tomorrow held new possibilities."
 
-    # Extract the generated story
-    generated_story = response.choices[0].message.content
+Using the given emotions, concerns, and extracted data, **create a unique, comforting story.**
+
+JUST RETURN THE STORY, NO ELSE THINKING OR ANYTHING ONLY STORY.""", user="{details}"))
+
+def compose_story_prompt(data, user_name=None, mood=None):
+    """Turns fetched Persons/Entities data and the mood summary into the story prompt's chat messages."""
+    persons = data["Persons"]
+    entities = data["Entities"]
+
+    if not persons:
+        logger.info("No persons found in the database to create a story.")
+        return None
+
+    # Graphs written before summaries existed have none until `python mood.py` rebuilds them
+    if mood is not None and not (mood["emotions"] or mood["concerns"]):
+        mood = None
+
+    # 🔎 Step 1: Pick the most relevant facts that fit the token budget
+    context = select_context(persons, entities, STORY_CONTEXT_TOKEN_BUDGET, user_name, mood)
+    emotions, concerns, personal_details = context["emotions"], context["concerns"], context["details"]
+    if context["dropped"]:
+        logger.debug("✂️ Dropped %d lower-ranked facts to stay within %d tokens: %s",
+                     len(context["dropped"]), STORY_CONTEXT_TOKEN_BUDGET,
+                     "; ".join(f"{fact['source']} → ({fact['relation']}) → {fact['target']}" for fact in context["dropped"]))
+
+    # 🟢 Step 2: Lay out the selected data; it is the only part of the prompt that varies
+    sections = []
+
+    # 🟣 Lead with how the user feels most recently
+    if mood is not None and mood["latest_tone"]:
+        sections.append(f"📌 **User's Latest Tone:** {mood['latest_tone']}\n\n")
+
+    # 🟡 Include Extracted Emotions
+    if emotions:
+        sections.append("📌 **User's Current Emotions:**\n" + "".join(f"- {emotion}\n" for emotion in emotions))
+
+    # 🔵 Include Extracted Concerns
+    if concerns:
+        sections.append("\n📌 **User's Concerns:**\n" + "".join(f"- {concern}\n" for concern in concerns))
+
+    # 🔴 Include the selected Extracted Data (Persons + Entities)
+    sections.append("\n📌 **Additional Details About User:**\n" + "".join(f"- {detail}\n" for detail in personal_details))
+
+    return prompts.render("story", details="".join(sections)).messages
+
+def generate_uplifting_story(user_id, user_name=None):
+    """Generates a mood-lifting story based on the user's emotions, concerns, and most relevant extracted data."""
+    prompt = build_story_prompt(user_id, user_name)
+    if prompt is None:
+        return
+
+    # 🔥 Step 3: Call Groq API (Different Model)
+    generated_story = dispatcher.complete_sync(prompt, STORY_MODEL, "story")
 
     return generated_story
 
+async def generate_uplifting_story_async(user_id, user_name=None, priority=INTERACTIVE):
+    """Async variant of generate_uplifting_story used by the API server.
+
+    By default someone is waiting on the story, so it goes ahead of queued
+    extraction; speculative generation passes BACKGROUND instead.
+    """
+    prompt = await build_story_prompt_async(user_id, user_name)
+    if prompt is None:
+        return
+
+    return await dispatcher.complete(prompt, STORY_MODEL, "story", priority=priority)
+
+# -------------------- Streaming --------------------
+
+class ThinkFilter:
+    """Drops <think>...</think> reasoning from a token stream, even when a tag is split across chunks."""
+
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_think = False
+        self.started = False  # Leading whitespace before the story itself is dropped
+
+    def feed(self, chunk):
+        """Consumes one chunk and returns the text that is safe to show."""
+        self.buffer += chunk
+        visible = []
+
+        while True:
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            index = self.buffer.find(tag)
+            if index != -1:
+                if not self.in_think:
+                    visible.append(self.buffer[:index])
+                self.buffer = self.buffer[index + len(tag):]
+                self.in_think = not self.in_think
+                continue
+
+            # Hold back anything that could be the start of a tag
+            held = partial_tag_length(self.buffer, tag)
+            if not self.in_think:
+                visible.append(self.buffer[:len(self.buffer) - held])
+            self.buffer = self.buffer[len(self.buffer) - held:]
+            break
+
+        return self._emit("".join(visible))
+
+    def flush(self):
+        """Returns whatever visible text is still buffered once the stream ends."""
+        rest = "" if self.in_think else self.buffer
+        self.buffer = ""
+        return self._emit(rest)
+
+    def _emit(self, text):
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
+def partial_tag_length(text, tag):
+    """Length of the longest suffix of text that is a proper prefix of tag."""
+    for length in range(min(len(text), len(tag) - 1), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+def strip_think(story):
+    """The visible part of a complete story."""
+    think_filter = ThinkFilter()
+    return think_filter.feed(story) + think_filter.flush()
+
+async def stream_uplifting_story(user_id, user_name=None):
+    """Yields the story's visible text as tokens arrive, with any <think> section filtered out."""
+    key = await story_key(user_id, user_name)
+    story = await lookup_story(key)
+    if story is None and not await claim_story(key):
+        story = await wait_for_shared_story(key)  # another worker just started it
+    if story is not None:
+        yield story
+        return
+
+    saved = False
+    try:
+        prompt = await build_story_prompt_async(user_id, user_name)
+        if prompt is None:
+            return
+
+        think_filter = ThinkFilter()
+        parts = []
+        async for delta in dispatcher.stream(prompt, STORY_MODEL, "story_stream", priority=INTERACTIVE):
+            text = think_filter.feed(delta)
+            if text:
+                parts.append(text)
+                yield text
+
+        text = think_filter.flush()
+        if text:
+            parts.append(text)
+            yield text
+        if parts:
+            await save_story(key, "".join(parts))
+            saved = True
+    finally:
+        if not saved:
+            await release_story(key)
+
+# -------------------- Memoization --------------------
+# Stories are cached per user and graph version, so the reasoning model only
+# runs again after a write has changed the user's graph. A story that is
+# already being generated (e.g. speculatively, right after the last answer was
+# stored) is awaited instead of being started a second time.
+#
+# With `uvicorn --workers N` the worker serving /generate-story/ is often not
+# the one that speculated. With STORY_BACKEND=sqlite (the default when sessions
+# use SQLite) finished stories and "in progress" markers also go to the shared
+# SQLite file, and a worker that finds another's marker waits for its story.
+
+# How long to wait on another worker's generation; older markers belong to a worker that died
+STORY_WAIT_TIMEOUT = float(os.getenv("STORY_WAIT_TIMEOUT", "180"))
+POLL_INTERVAL = 0.25
+
+class SQLiteStoryStore:
+    """Stories and in-progress markers keyed on (user_id, graph version, variant), shared by every worker on the host."""
+
+    def __init__(self, path, stale_after=STORY_WAIT_TIMEOUT):
+        self.stale_after = stale_after
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # story is NULL while the story is being generated
+        self.db.execute("CREATE TABLE IF NOT EXISTS stories (user_id TEXT NOT NULL, version INTEGER NOT NULL, variant TEXT NOT NULL, "
+                        "story TEXT, updated_at REAL NOT NULL, PRIMARY KEY (user_id, version, variant))")
+        self.db.commit()
+
+    def get(self, key):
+        """(story, whether a live worker is generating it)."""
+        with self.lock:
+            row = self.db.execute("SELECT story, updated_at FROM stories WHERE user_id = ? AND version = ? AND variant = ?", key).fetchone()
+        if row is None:
+            return None, False
+        return row[0], row[0] is None and row[1] >= time.time() - self.stale_after
+
+    def claim(self, key):
+        """Marks the story as in progress; False if it's done or another worker is already on it."""
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO stories (user_id, version, variant, story, updated_at) VALUES (?, ?, ?, NULL, ?) "
+                "ON CONFLICT (user_id, version, variant) DO UPDATE SET updated_at = excluded.updated_at "
+                "WHERE stories.story IS NULL AND stories.updated_at < ?", (*key, now, now - self.stale_after))
+            self.db.commit()
+        return cursor.rowcount == 1
+
+    def save(self, key, story):
+        """Stores the finished story and drops the user's stories of older graph versions."""
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO stories (user_id, version, variant, story, updated_at) VALUES (?, ?, ?, ?, ?)",
+                            (*key, story, time.time()))
+            self.db.execute("DELETE FROM stories WHERE user_id = ? AND version < ?", key[:2])
+            self.db.commit()
+
+    def release(self, key):
+        """Drops an in-progress marker whose generation failed or produced nothing."""
+        with self.lock:
+            self.db.execute("DELETE FROM stories WHERE user_id = ? AND version = ? AND variant = ? AND story IS NULL", key)
+            self.db.commit()
+
+def make_story_store():
+    """The shared store chosen by STORY_BACKEND ("sqlite", or "memory" for this process only)."""
+    if os.getenv("STORY_BACKEND", os.getenv("SESSION_BACKEND", "memory")) == "sqlite":
+        return SQLiteStoryStore(os.getenv("STORY_DB_PATH") or os.getenv("SESSION_DB_PATH", "sessions.sqlite3"))
+    return None
+
+story_cache = ExtractionCache(max_entries=int(os.getenv("STORY_CACHE_SIZE", "1024")))
+story_store = make_story_store()
+story_tasks = {}  # cache key -> task generating that story in this worker
+
+async def story_key(user_id, user_name=None):
+    """Cache key for the story of the user's graph as it is right now: (user_id, graph version, variant)."""
+    version = await fetch_graph_version_async(user_id)
+    return (user_id, version, f"{user_name or ''}:{STORY_MODEL}:{prompts.get('story').version}:{STORY_CONTEXT_TOKEN_BUDGET}")
+
+# The shared store's calls block on SQLite, so they run in a thread
+async def claim_story(key):
+    return story_store is None or await asyncio.to_thread(story_store.claim, key)
+
+async def save_story(key, story):
+    story_cache.set(key, story)
+    if story_store is not None:
+        await asyncio.to_thread(story_store.save, key, story)
+
+async def release_story(key):
+    if story_store is not None:
+        await asyncio.to_thread(story_store.release, key)
+
+async def wait_for_shared_story(key):
+    """The story another worker is generating for key, once it's done; None if there is none or it takes too long."""
+    if story_store is None:
+        return None
+    deadline = time.monotonic() + STORY_WAIT_TIMEOUT
+    while True:
+        story, running = await asyncio.to_thread(story_store.get, key)
+        if story is not None:
+            story_cache.set(key, story)
+            return story
+        if not running or time.monotonic() >= deadline:
+            return None
+        await asyncio.sleep(POLL_INTERVAL)
+
+async def lookup_story(key):
+    """The story for key if it's cached or already being generated here or by another worker, else None."""
+    story = story_cache.get(key)
+    if story is not None:
+        return story
+    if key in story_tasks:
+        # A caller that disconnects must not cancel generation others may be waiting on
+        return await asyncio.shield(story_tasks[key])
+    return await wait_for_shared_story(key)
+
+async def remember_story(key, user_id, user_name, priority):
+    if not await claim_story(key):
+        story = await wait_for_shared_story(key)
+        if story is not None:
+            return story
+        # The other worker gave up or died, so it's generated here after all
+
+    story = None
+    try:
+        story = await generate_uplifting_story_async(user_id, user_name, priority)
+        if story:
+            story = strip_think(story)
+            await save_story(key, story)
+    finally:
+        if not story:
+            await release_story(key)
+    return story
+
+def story_task(key, user_id, user_name, priority=INTERACTIVE):
+    """The task generating the story for key, started if there isn't one yet."""
+    task = story_tasks.get(key)
+    if task is None:
+        task = asyncio.ensure_future(remember_story(key, user_id, user_name, priority))
+        story_tasks[key] = task
+        task.add_done_callback(lambda _: story_tasks.pop(key, None))
+    return task
+
+async def get_uplifting_story_async(user_id, user_name=None):
+    """The story for the user's current graph: cached, already in progress, or generated now."""
+    key = await story_key(user_id, user_name)
+    story = await lookup_story(key)
+    if story is not None:
+        return story
+    return await asyncio.shield(story_task(key, user_id, user_name))
+
+def log_speculation_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("⚠️ Speculative story generation failed: %s", task.exception())
+
+async def speculate_story(user_id, user_name=None):
+    """Starts generating the story for the user's current graph in the background.
+
+    It's generated at BACKGROUND priority, so it doesn't compete with stories
+    users are waiting on; a request that joins it simply waits for it.
+    """
+    key = await story_key(user_id, user_name)
+    if key in story_tasks or story_cache.get(key) is not None:
+        return
+    if story_store is not None:
+        story, running = await asyncio.to_thread(story_store.get, key)
+        if story is not None or running:
+            return
+    logger.debug("🔮 Speculatively generating the story for %s", user_id)
+    story_task(key, user_id, user_name, BACKGROUND).add_done_callback(log_speculation_failure)
+
 if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python storygen.py <user_id>")
     print("\n📖 Generating a **mood-lifting** story with Groq...\n")
-    story = generate_uplifting_story()
+    story = generate_uplifting_story(sys.argv[1])
     if story:
         print(story)
@@ -4,11 +4,11 @@ import UserInfo from "./userInfo";
 import Questionnaire from "./questionnaire";
 
 function App() {
-  const [userInfo, setUserInfo] = useState<{ name: string; age: string; gender: string } | null>(
+  const [userInfo, setUserInfo] = useState<{ name: string; age: string; gender: string; user_id?: string; session_token?: string } | null>(
     () => JSON.parse(localStorage.getItem("userInfo") || "null")
   );
   
-  const handleUserSubmit = (info: { name: string; age: string; gender: string }) => {
+  const handleUserSubmit = (info: { name: string; age: string; gender: string; user_id?: string; session_token?: string }) => {
     setUserInfo(info);
     localStorage.setItem("userInfo", JSON.stringify(info)); // ✅ Save in localStorage
   };
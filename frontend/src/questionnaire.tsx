@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { Send, ArrowRight, CheckCircle } from "lucide-react";
 import { useNavigate } from "react-router-dom";
 
@@ -11,10 +11,19 @@ const QUESTIONS = [
   "If you could change one thing about your current situation to feel better, what would it be?"
 ];
 
+// ✅ Answers are sent to /process-answers/ in chunks of this size (the last chunk may be smaller)
+const ANSWER_BATCH_SIZE = 3;
+
 interface QuestionnaireProps {
-  userInfo: { name: string; age: string; gender: string };
+  userInfo: { name: string; age: string; gender: string; user_id?: string; session_token?: string };
 }
 
+// ✅ Every request after /store-user/ identifies the user by their session token
+const sessionHeaders = (): Record<string, string> => {
+  const storedUserInfo = JSON.parse(localStorage.getItem("userInfo") || "null");
+  return storedUserInfo?.session_token ? { "X-Session-Token": storedUserInfo.session_token } : {};
+};
+
 const Questionnaire: React.FC<QuestionnaireProps> = ({ userInfo }) => {
   const [currentQuestionIndex, setCurrentQuestionIndex] = useState(0);
   const [responses, setResponses] = useState<Record<string, string>>({});
@@ -23,31 +32,40 @@ const Questionnaire: React.FC<QuestionnaireProps> = ({ userInfo }) => {
   const [animation, setAnimation] = useState(false);  // ✅ Fixed missing state
   const [loading, setLoading] = useState(false);
   const [generatedStory, setGeneratedStory] = useState<string | null>(null); // ✅ Fixed missing state
+  const pendingAnswers = useRef<string[]>([]);
   const navigate = useNavigate();
 
-  // Function to send answer to FastAPI
-  const processAnswer = async (text: string) => {
+  // Function to send a chunk of answers to FastAPI
+  const processAnswers = async (answers: string[], final: boolean) => {
     setLoading(true);
     const storedUserInfo = JSON.parse(localStorage.getItem("userInfo") || "null");
   
-    if (!storedUserInfo) {
+    if (!storedUserInfo?.session_token) {
       console.error("❌ User info missing!"); // ✅ Debugging
       alert("User info is missing! Please start again.");
       navigate("/");
       return;
     }
   
-    console.log("📤 Sending Data:", { text, user_info: storedUserInfo });
+    console.log("📤 Sending Data:", { answers });
   
     try {
-      const response = await fetch("http://127.0.0.1:8000/process-answer/", {
+      const response = await fetch("http://127.0.0.1:8000/process-answers/", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ text, user_info: storedUserInfo }),
+        headers: { "Content-Type": "application/json", ...sessionHeaders() },
+        // ✅ Queue the answers in the background; the story endpoint waits for them to finish.
+        // `final` lets the server start writing the story before we ask for it.
+        body: JSON.stringify({ answers, background: true, final }),
       });
   
-      if (!response.ok) throw new Error("Failed to process answer.");
-      console.log("✅ Answer stored:", await response.json());
+      if (response.status === 401) {
+        alert("Your session has expired! Please start again.");
+        setLoading(false);
+        navigate("/");
+        return;
+      }
+      if (!response.ok) throw new Error("Failed to process answers.");
+      console.log("✅ Answers queued:", await response.json());
     } catch (error) {
       console.error("❌ Error:", error);
     }
@@ -62,7 +80,15 @@ const Questionnaire: React.FC<QuestionnaireProps> = ({ userInfo }) => {
     if (!answer.trim()) return;
 
     setResponses((prev) => ({ ...prev, [QUESTIONS[currentQuestionIndex]]: answer }));
-    await processAnswer(answer);
+
+    // Buffer answers and send them a chunk at a time; the last question flushes whatever is left
+    pendingAnswers.current.push(answer);
+    const isLastQuestion = currentQuestionIndex >= QUESTIONS.length - 1;
+    if (pendingAnswers.current.length >= ANSWER_BATCH_SIZE || isLastQuestion) {
+      const chunk = pendingAnswers.current;
+      pendingAnswers.current = [];
+      await processAnswers(chunk, isLastQuestion);
+    }
 
     // Animate transition
     setAnimation(true);
@@ -77,16 +103,18 @@ const Questionnaire: React.FC<QuestionnaireProps> = ({ userInfo }) => {
     }, 400);
   };
 
-  // Fetch the story once all questions are answered
+  // Stream the story once all questions are answered
   useEffect(() => {
     if (isComplete) {
-      fetchStory();
+      const source = streamStory();
+      return () => source.close();
     }
   }, [isComplete]);
 
+  // Fallback: fetch the whole story in one response
   const fetchStory = async () => {
     try {
-      const response = await fetch("http://127.0.0.1:8000/generate-story/");
+      const response = await fetch("http://127.0.0.1:8000/generate-story/", { headers: sessionHeaders() });
       if (!response.ok) {
         throw new Error("Failed to generate story.");
       }
@@ -98,6 +126,36 @@ const Questionnaire: React.FC<QuestionnaireProps> = ({ userInfo }) => {
     }
   };
 
+  // Stream the story token by token (SSE) so text shows up as soon as it's generated
+  const streamStory = () => {
+    const storedUserInfo = JSON.parse(localStorage.getItem("userInfo") || "null");
+    // EventSource can't send headers, so the token goes in the query string
+    const token = storedUserInfo?.session_token ?? "";
+    const source = new EventSource(`http://127.0.0.1:8000/generate-story/stream?session=${encodeURIComponent(token)}`);
+    let received = false;
+
+    source.onmessage = (event) => {
+      const { text } = JSON.parse(event.data);
+      received = true;
+      setGeneratedStory((prev) => (prev ?? "") + text);
+    };
+
+    source.addEventListener("done", () => {
+      console.log("📖 Story stream finished");
+      source.close();
+    });
+
+    source.onerror = () => {
+      source.close();
+      if (!received) {
+        console.error("❌ Story stream failed, falling back to a single request");
+        fetchStory();
+      }
+    };
+
+    return source;
+  };
+
   return (
     <div className="min-h-screen bg-gradient-to-br from-indigo-100 via-purple-50 to-blue-100 flex items-center justify-center p-4">
       <div className="w-full max-w-lg h-[650px] bg-white rounded-2xl shadow-xl overflow-hidden">
@@ -139,7 +197,7 @@ const Questionnaire: React.FC<QuestionnaireProps> = ({ userInfo }) => {
               </div>
               <h2 className="text-2xl font-bold text-gray-800">Your Personalized Story</h2>
               {generatedStory ? (
-                <p className="text-gray-700 text-lg leading-relaxed px-4">{generatedStory}</p>
+                <p className="text-gray-700 text-lg leading-relaxed px-4 whitespace-pre-line">{generatedStory}</p>
               ) : (
                 <p className="text-gray-600">Generating your story... Please wait.</p>
               )}
@@ -150,6 +208,7 @@ const Questionnaire: React.FC<QuestionnaireProps> = ({ userInfo }) => {
                   setResponses({});
                   setIsComplete(false);
                   setGeneratedStory(null);
+                  pendingAnswers.current = [];
                   navigate("/"); // Navigate back to user info form
                 }}
                 className="mt-4 px-6 py-2 bg-indigo-600 text-white rounded-lg hover:bg-indigo-700 transition-colors"
@@ -3,7 +3,7 @@ import { useNavigate } from "react-router-dom";
 import { User, Users } from "lucide-react";
 
 interface UserInfoProps {
-  onSubmit: (userInfo: { name: string; age: string; gender: string }) => void;
+  onSubmit: (userInfo: { name: string; age: string; gender: string; user_id?: string; session_token?: string }) => void;
 }
 
 const UserInfo: React.FC<UserInfoProps> = ({ onSubmit }) => {
@@ -33,10 +33,13 @@ const UserInfo: React.FC<UserInfoProps> = ({ onSubmit }) => {
         throw new Error(`❌ Request failed: ${response.status} ${response.statusText}`);
       }
   
+      const data = await response.json();
       console.log("✅ User info stored in FastAPI");
   
-      localStorage.setItem("userInfo", JSON.stringify(formData)); // ✅ Save in localStorage
-      onSubmit(formData); // ✅ Update state
+      // ✅ Keep the id that scopes this user's graph and the token that identifies their session
+      const storedInfo = { ...formData, user_id: data.user_id, session_token: data.session_token };
+      localStorage.setItem("userInfo", JSON.stringify(storedInfo)); // ✅ Save in localStorage
+      onSubmit(storedInfo); // ✅ Update state
       navigate("/questionnaire");
     } catch (error) {
       console.error("❌ Error storing user info:", error);